@@ -1,12 +1,13 @@
 import os
 import time
+import multiprocessing
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                              QHBoxLayout, QLineEdit, QPushButton, QProgressBar,
-                             QLabel, QFileDialog, QMessageBox, QGroupBox, QGridLayout, QDialog)
+                             QLabel, QFileDialog, QMessageBox, QGroupBox, QGridLayout, QDialog,
+                             QPlainTextEdit, QCheckBox)
 from PyQt6.QtCore import Qt, QThread, pyqtSignal, pyqtSlot, QObject, QSize
 from PyQt6.QtGui import QIcon, QFont, QPixmap
-import pandas as pd
-from openpyxl import Workbook
+from metadata_scanner import Scanner
 
 STYLE_SHEET = """
 QMainWindow {
@@ -95,120 +96,48 @@ QMessageBox QPushButton {
 
 
 class Worker(QObject):
-    progress = pyqtSignal(int, int, float, float, float, float, int)  # Added records count
+    # processed, total, processed size, remaining size, elapsed, remaining time,
+    # records, files/sec, bytes/sec
+    progress = pyqtSignal(int, int, float, float, float, float, int, float, float)
+    errors = pyqtSignal(list)  # Batched per-file errors, shown in the error log
     finished = pyqtSignal()
-    error = pyqtSignal(str)
+    error = pyqtSignal(str)  # Fatal error that ends the scan
 
-    def __init__(self, folder_path, output_path):
+    def __init__(self, folder_path, output_path, profile=False):
         super().__init__()
         self.folder_path = folder_path
         self.output_path = output_path
-        self._is_running = True
-        self.total_records = 0  # Track total records
+        self.profile = profile  # Full column profiling instead of header names only
+        self.scanner = Scanner([folder_path], output_path, profile=profile,
+                               on_progress=self._publish, on_errors=self.errors.emit)
+
+    @property
+    def total_records(self):
+        return self.scanner.total_records
 
     def stop(self):
-        self._is_running = False
+        self.scanner.stop()
 
     def run(self):
         try:
-            # Phase 1: File enumeration
-            file_list = []
-            total_size = 0
-            total_files = 0
-
-            for root, _, files in os.walk(self.folder_path):
-                for file in files:
-                    if not self._is_running:
-                        return
-                    if file.lower().endswith(('.xlsx', '.xls', '.csv')):
-                        file_path = os.path.join(root, file)
-                        file_size = os.path.getsize(file_path)
-                        file_list.append((file_path, file_size))
-                        total_size += file_size
-                        total_files += 1
-
-            # Phase 2: File processing
-            processed_files = 0
-            processed_size = 0
-            start_time = time.time()
-
-            wb = Workbook(write_only=True)
-            ws = wb.create_sheet()
-            ws.append(['File Name', 'Path', 'Sheet Name', 'Column Name'])
-
-            for file_path, file_size in file_list:
-                if not self._is_running:
-                    break
-
-                processed_size += file_size
-                processed_files += 1
-                elapsed = time.time() - start_time
-                avg_time_per_file = elapsed / processed_files if processed_files else 0
-                remaining_time = avg_time_per_file * (total_files - processed_files)
-                records_added = 0  # Records added for current file
-
-                try:
-                    if file_path.lower().endswith(('.xlsx', '.xls')):
-                        with pd.ExcelFile(file_path) as excel:
-                            for sheet_name in excel.sheet_names:
-                                # Read the Excel file without specifying the header
-                                df = pd.read_excel(excel, sheet_name=sheet_name, header=None, nrows=10)
-                                print([col for col in df.columns.tolist()])
-                                # Find the first non-null row
-                                first_non_null_index = df.first_valid_index()
-
-                                if first_non_null_index is not None:
-                                    # Set the first non-null row as the header
-                                    new_header = df.iloc[first_non_null_index]  # Get the first non-null row
-                                    df = df[1:]  # Take the data less the header row
-                                    df.columns = new_header  # Set the new header
-
-                                # Now df has the first non-null row as the columns
-                                columns = df.columns.tolist()
-                                records_added += len(columns)
-                                for col in columns:
-                                    ws.append([
-                                        os.path.basename(file_path),
-                                        file_path,
-                                        sheet_name,
-                                        col
-                                    ])
-                    elif file_path.lower().endswith('.csv'):
-                        df = pd.read_csv(file_path, nrows=0)
-                        columns = df.columns.tolist()
-                        records_added += len(columns)
-                        for col in columns:
-                            ws.append([
-                                os.path.basename(file_path),
-                                file_path,
-                                'CSV',
-                                col
-                            ])
-
-                    self.total_records += records_added
-
-                except Exception as e:
-                    self.error.emit(f"Error processing {file_path}: {str(e)}")
-
-                # Emit progress with records count
-                self.progress.emit(
-                    processed_files,
-                    total_files,
-                    processed_size,
-                    total_size - processed_size,
-                    elapsed,
-                    remaining_time,
-                    self.total_records
-                )
-
-            # Create directory if needed and save
-            os.makedirs(os.path.dirname(self.output_path), exist_ok=True)
-            wb.save(self.output_path)
+            self.scanner.run()
             self.finished.emit()
-
         except Exception as e:
             self.error.emit(str(e))
 
+    def _publish(self, state):
+        self.progress.emit(
+            state.processed_files,
+            state.total_files,
+            state.processed_size,
+            state.total_size - state.processed_size,
+            state.elapsed,
+            state.remaining_time,
+            state.total_records,
+            state.files_per_second,
+            state.bytes_per_second
+        )
+
 
 TEAM_LOGO_PATH = "team_logo.png"  # Path to your team logo (PNG format recommended)
 APP_LOGO_PATH = "icon.png"  # Path to your team logo (PNG format recommended)
@@ -315,6 +244,7 @@ class ModernMainWindow(QMainWindow):
         self.elapsed_time_label = self.create_stat_label()
         self.remaining_time_label = self.create_stat_label()
         self.total_records_label = self.create_stat_label()  # New records counter
+        self.throughput_label = self.create_stat_label()
 
         stats_grid.addWidget(QLabel("Files Processed:"), 0, 0)
         stats_grid.addWidget(self.processed_files_label, 0, 1)
@@ -333,10 +263,21 @@ class ModernMainWindow(QMainWindow):
 
         stats_grid.addWidget(QLabel("Total Records Added:"), 3, 0)
         stats_grid.addWidget(self.total_records_label, 3, 1)
+        stats_grid.addWidget(QLabel("Throughput:"), 3, 2)
+        stats_grid.addWidget(self.throughput_label, 3, 3)
 
         progress_layout.addWidget(self.progress_bar)
         progress_layout.addLayout(stats_grid)
 
+        # Error log (non-blocking, replaces one message box per failed file)
+        self.error_group = QGroupBox("Errors (0)")
+        error_layout = QVBoxLayout(self.error_group)
+        self.error_log = QPlainTextEdit()
+        self.error_log.setReadOnly(True)
+        self.error_log.setMaximumBlockCount(5000)  # Keep memory bounded on huge scans
+        error_layout.addWidget(self.error_log)
+        self.error_count = 0
+
         # Control buttons
         self.scan_button = QPushButton("Start Scanning")
         self.scan_button.setIcon(QIcon.fromTheme("document-save"))
@@ -345,6 +286,8 @@ class ModernMainWindow(QMainWindow):
         font.setBold(True)
         self.scan_button.setFont(font)
 
+        self.profile_checkbox = QCheckBox("Profile columns (types, null ratio, min/max, distinct count)")
+
         # Team logo button in bottom-left corner
         self.team_logo_button = QPushButton(self)
         self.team_logo_button.setIcon(QIcon(TEAM_LOGO_PATH))
@@ -357,6 +300,8 @@ class ModernMainWindow(QMainWindow):
         # Assemble main layout
         main_layout.addLayout(folder_layout)
         main_layout.addWidget(progress_group)
+        main_layout.addWidget(self.error_group)
+        main_layout.addWidget(self.profile_checkbox)
         main_layout.addWidget(self.scan_button)
         main_layout.addWidget(self.team_logo_button, alignment=Qt.AlignmentFlag.AlignRight)
 
@@ -402,8 +347,12 @@ class ModernMainWindow(QMainWindow):
 
         self.scan_button.setEnabled(False)
         self.browse_button.setEnabled(False)
+        self.profile_checkbox.setEnabled(False)
+        self.error_log.clear()
+        self.error_count = 0
+        self.error_group.setTitle("Errors (0)")
         self.thread = QThread()
-        self.worker = Worker(self.folder_input.text(), output_path)
+        self.worker = Worker(self.folder_input.text(), output_path, self.profile_checkbox.isChecked())
         self.worker.moveToThread(self.thread)
 
         self.thread.started.connect(self.worker.run)
@@ -412,6 +361,7 @@ class ModernMainWindow(QMainWindow):
         self.worker.finished.connect(self.state_change)
         self.thread.finished.connect(self.thread.deleteLater)
         self.worker.progress.connect(self.update_progress)
+        self.worker.errors.connect(self.append_errors)
         self.worker.error.connect(self.show_error)
 
         self.thread.start()
@@ -420,10 +370,11 @@ class ModernMainWindow(QMainWindow):
         self.progress_bar.setFormat(f"100% - Process finished.")
         self.browse_button.setEnabled(True)
         self.scan_button.setEnabled(True)
+        self.profile_checkbox.setEnabled(True)
 
-    @pyqtSlot(int, int, float, float, float, float, int)
+    @pyqtSlot(int, int, float, float, float, float, int, float, float)
     def update_progress(self, current, total, processed_size, remaining_size,
-                        elapsed, remaining_time, total_records):
+                        elapsed, remaining_time, total_records, files_rate, bytes_rate):
         progress = int((current / total) * 100) if total else 0
         self.progress_bar.setValue(progress)
         self.progress_bar.setFormat(f"{progress}% - Processing...")
@@ -437,6 +388,13 @@ class ModernMainWindow(QMainWindow):
         self.elapsed_time_label.setText(time.strftime('%H:%M:%S', time.gmtime(elapsed)))
         self.remaining_time_label.setText(time.strftime('%H:%M:%S', time.gmtime(remaining_time)))
         self.total_records_label.setText(f"{total_records}")  # Update records count
+        self.throughput_label.setText(f"{files_rate:.1f} files/s, {bytes_rate / (1024 ** 2):.2f} MB/s")
+
+    @pyqtSlot(list)
+    def append_errors(self, messages):
+        self.error_count += len(messages)
+        self.error_group.setTitle(f"Errors ({self.error_count})")
+        self.error_log.appendPlainText("\n".join(messages))
 
     @pyqtSlot(str)
     def show_error(self, message):
@@ -446,10 +404,19 @@ class ModernMainWindow(QMainWindow):
     def closeEvent(self, event):
         if self.worker:
             self.worker.stop()
+        if self.thread:
+            try:
+                # Let the worker write its checkpoint before the app exits
+                if self.thread.isRunning():
+                    self.thread.quit()
+                    self.thread.wait()
+            except RuntimeError:
+                pass  # Thread object already deleted after a finished scan
         event.accept()
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Parser child processes in the frozen build
     app = QApplication([])
     app.setStyle("Fusion")
     app.setStyleSheet(STYLE_SHEET)
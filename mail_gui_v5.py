@@ -1,8 +1,6 @@
-import random
 import sys
 import os
 import json
-import time
 from datetime import datetime, timedelta
 from cryptography.fernet import Fernet
 import requests
@@ -11,10 +9,18 @@ from PyQt6.QtWidgets import (
     QLabel, QLineEdit, QPushButton, QTextEdit, QListWidget,
     QMessageBox, QFileDialog, QStackedWidget, QSystemTrayIcon, QMenu, QInputDialog, QDialog
 )
-from PyQt6.QtCore import pyqtSignal, QTimer, QDate, Qt
+from PyQt6.QtCore import pyqtSignal, QTimer, Qt, QThread, QObject
 from PyQt6.QtGui import QAction, QIcon, QPixmap
 from exchangelib import Credentials, Account, DELEGATE, Configuration, Message, Mailbox, FileAttachment
 from exchangelib.errors import UnauthorizedError
+from mail_sync import (
+    DOWNLOAD_RATE, DOWNLOAD_WORKERS, MAX_CONNECTIONS, QUEUE_PATH, JobQueue, MailboxEngine, MailboxSource, Session,
+    ews_endpoint
+)
+from mail_schedule import RETRY_SECONDS, Schedule, daily
+from mail_upload import (
+    BATCH_BYTES, SENT_INDEX_PATH, UPLOAD_RATE, UPLOAD_WORKERS, SentIndex, Uploader, upload_name, upload_url
+)
 import hashlib
 import base64
 
@@ -133,7 +139,10 @@ class TrayIcon(QSystemTrayIcon):
                 print(f"User entered hour: {hour}")
                 self.schedule_hour = hour
                 self.update_config("schedule_hour", hour)
+                self.update_config("schedule", daily(hour))
                 print("Config updated successfully.")
+                if self.email_client:
+                    self.email_client.load_schedule()
                 self.showMessage("Schedule Updated",
                                  f"Daily tasks scheduled for {hour}:00",
                                  QSystemTrayIcon.MessageIcon.Information)
@@ -179,11 +188,8 @@ class TrayIcon(QSystemTrayIcon):
         if not self.email_client:
             self.email_client = EmailClientHandler(self)
         try:
-            self.email_client.process_attachments()
-            self.email_client.upload_attachments()
-            self.showMessage("Processing Complete",
-                             "Mail processing finished",
-                             QSystemTrayIcon.MessageIcon.Information)
+            # Runs in the background; each attachment is uploaded as soon as it is saved
+            self.email_client.process_and_upload()
         except Exception as e:
             self.showMessage("Error", str(e),
                              QSystemTrayIcon.MessageIcon.Critical)
@@ -231,6 +237,48 @@ class TrayIcon(QSystemTrayIcon):
                          QSystemTrayIcon.MessageIcon.Information)
 
 
+def connect_account(email, password, endpoint, mailbox=None, max_connections=MAX_CONNECTIONS):
+    """Log in with NTLM and test the connection; returns the Account for mailbox
+    (a shared mailbox the login may open), or for the login's own mailbox."""
+    # Split email to get domain and username
+    domain_part = email.split('@')[1].split('.')[0].upper()  # Extracts "MCI" from "a.kakoolvand@mci.ir"
+    username = f"{domain_part}\\{email.split('@')[0]}"  # Format as "MCI\a.kakoolvand"
+
+    # Use email as primary_smtp_address, username for authentication
+    credentials = Credentials(username=username, password=password)
+
+    config = Configuration(
+        credentials=credentials,
+        service_endpoint=endpoint,
+        auth_type=NTLM  # Force NTLM authentication
+    )
+
+    account = Account(
+        primary_smtp_address=mailbox or email,  # Keep the email address here
+        config=config,
+        autodiscover=False,
+        access_type=DELEGATE
+    )
+    # Mailboxes opened with the same login share its connection pool
+    account.protocol.max_connections = max_connections
+
+    # Disable SSL verification
+    session = requests.Session()
+    session.verify = False
+    account.protocol.session = session  # Apply session before any requests
+
+    account.root.refresh()  # Test connection
+    return account
+
+
+def stored_credentials(config):
+    """(email, password) saved by the login window, or None."""
+    if 'encrypted_user' not in config or 'encrypted_pass' not in config:
+        return None
+    return (cipher.decrypt(config['encrypted_user'].encode()).decode(),
+            cipher.decrypt(config['encrypted_pass'].encode()).decode())
+
+
 class LoginWindow(QMainWindow):
     global account, logged_in
     login_success = pyqtSignal()
@@ -281,13 +329,12 @@ class LoginWindow(QMainWindow):
     def load_encrypted_credentials(self):
         try:
             with open("config.json", "r") as f:
-                config = json.load(f)
-                if 'encrypted_user' in config and 'encrypted_pass' in config:
-                    email_user = cipher.decrypt(config['encrypted_user'].encode()).decode()
-                    password = cipher.decrypt(config['encrypted_pass'].encode()).decode()
-                    self.email_input.setText(email_user)
-                    self.password_input.setText(password)
-                    return True
+                credentials = stored_credentials(json.load(f))
+            if credentials:
+                email_user, password = credentials
+                self.email_input.setText(email_user)
+                self.password_input.setText(password)
+                return True
         except Exception as e:
             print(f"Error loading credentials: {e}")
             self.tray_icon.showMessage("Credentials Error",
@@ -295,38 +342,20 @@ class LoginWindow(QMainWindow):
                                        QSystemTrayIcon.MessageIcon.Warning)
         return False
 
+    def load_endpoint(self):
+        try:
+            with open("config.json", "r") as f:
+                return ews_endpoint(json.load(f))
+        except Exception:
+            return ews_endpoint({})
+
     def attempt_basic_login(self):
         global account, logged_in
         email = self.email_input.text()
         password = self.password_input.text()
 
         try:
-            # Split email to get domain and username
-            domain_part = email.split('@')[1].split('.')[0].upper()  # Extracts "MCI" from "a.kakoolvand@mci.ir"
-            username = f"{domain_part}\\{email.split('@')[0]}"  # Format as "MCI\a.kakoolvand"
-
-            # Use email as primary_smtp_address, username for authentication
-            credentials = Credentials(username=username, password=password)
-
-            config = Configuration(
-                credentials=credentials,
-                service_endpoint="https://mail.mci.ir/ews/exchange.asmx",
-                auth_type=NTLM  # Force NTLM authentication
-            )
-
-            account = Account(
-                primary_smtp_address=email,  # Keep the email address here
-                config=config,
-                autodiscover=False,
-                access_type=DELEGATE
-            )
-
-            # Disable SSL verification
-            session = requests.Session()
-            session.verify = False
-            account.protocol.session = session  # Apply session before any requests
-
-            account.root.refresh()  # Test connection
+            account = connect_account(email, password, self.load_endpoint())
 
             # Success handling
             self.login_success.emit()
@@ -357,7 +386,7 @@ class LoginWindow(QMainWindow):
             credentials = Credentials(username=email, password=f"{password}{otp}")
             config = Configuration(
                 credentials=credentials,
-                service_endpoint="https://mail.mci.ir/ews/exchange.asmx"
+                service_endpoint=self.load_endpoint()
             )
             account = Account(
                 primary_smtp_address=email,
@@ -478,10 +507,172 @@ class AboutTeamDialog(QDialog):
         pass
 
 
-class EmailClientHandler:
+class MailService(QObject):
+    """All mailbox work, on its own thread: session checks, re-authentication and
+    processing runs. Requests are queued signals, so jobs run one at a time in the
+    order they were asked for and the GUI thread never waits on the network."""
+    total = pyqtSignal(int)  # Emails to process
+    progress = pyqtSignal(int, int, int)  # Emails processed, attachments found, attachments saved
+    failed = pyqtSignal(str)  # One attachment could not be saved; the others go on
+    uploaded = pyqtSignal(int)  # Saved attachments uploaded so far (one file can hold several)
+    upload_failed = pyqtSignal(str)  # One file could not be uploaded; its email is retried next run
+    finished = pyqtSignal()
+    error = pyqtSignal(str)  # Fatal error that ends the run
+    session_checked = pyqtSignal(bool, str)  # Session usable, error when it is not
+    mailbox_total = pyqtSignal(str, int)  # Mailbox address, emails to process in it
+    mailbox_progress = pyqtSignal(str, int)  # Mailbox address, emails processed in it
+    mailbox_failed = pyqtSignal(str, str)  # Mailbox address, error; the other mailboxes go on
+
+    def __init__(self):
+        super().__init__()
+        self.engine = None
+        self.files_uploaded = 0
+        self.files_failed = 0
+        self.counts = {}  # Mailbox address -> (processed emails, attachments found, attachments saved)
+        try:
+            with open("config.json", "r") as f:
+                config = json.load(f)
+        except (OSError, ValueError):
+            config = {}
+        self.session = Session.from_config(config, self.login)
+        self.sessions = {}  # Sessions of the configured "mailboxes", by their settings
+
+    def stop(self):
+        """Called from the GUI thread; ends the current run early."""
+        if self.engine is not None:
+            self.engine.stop()
+
+    def login(self, mailbox=None):
+        """Log in with the credentials saved by the login window, or with the
+        mailbox's own when a "mailboxes" entry has them."""
+        with open("config.json", "r") as f:
+            config = json.load(f)
+        mailbox = mailbox or {}
+        credentials = stored_credentials(mailbox) or stored_credentials(config)
+        if not credentials:
+            raise ValueError("Not authenticated with email server")
+        return connect_account(*credentials, ews_endpoint({**config, **mailbox}), mailbox.get("address"),
+                               int(mailbox.get("max_connections", config.get("max_connections", MAX_CONNECTIONS))))
+
+    def mailbox_sources(self, config):
+        """The logged-in mailbox, then each entry of "mailboxes" in config.json.
+
+        An entry is {"address": ...} for a shared mailbox opened with the app's
+        login, plus "encrypted_user"/"encrypted_pass" (and "ews_endpoint") for one
+        with a login of its own. "max_connections", "download_workers" and
+        "download_rate" can be set per entry.
+        """
+        workers = int(config.get("download_workers", DOWNLOAD_WORKERS))
+        rate = float(config.get("download_rate", DOWNLOAD_RATE))
+        sources = [MailboxSource(account.primary_smtp_address, self.session, workers, rate)]
+        for mailbox in config.get("mailboxes", []):
+            if any(source.address.lower() == mailbox["address"].lower() for source in sources):
+                continue
+            settings = json.dumps(mailbox, sort_keys=True)
+            if settings not in self.sessions:
+                self.sessions[settings] = Session.from_config(config, lambda mailbox=mailbox: self.login(mailbox))
+            sources.append(MailboxSource(mailbox["address"], self.sessions[settings],
+                                         int(mailbox.get("download_workers", workers)),
+                                         float(mailbox.get("download_rate", rate))))
+        return sources
+
+    def ensure_session(self):
+        """Log in again with the stored credentials when the session stopped working
+        or is about to expire; a recently checked session costs no request."""
+        global account, logged_in
+        if account is not None and logged_in and account is not self.session.account:
+            self.session.attach(account)  # Logged in from the login window
+        account = self.session.ensure()
+        logged_in = True
+        return True
+
+    def check_session(self):
+        try:
+            self.session_checked.emit(self.ensure_session(), "")
+        except Exception as e:
+            self.session_checked.emit(False, f"Stored credentials invalid. Please check error.{e}")
+
+    def on_uploaded(self, path, error, saved):
+        print(f"Uploaded: {upload_name(path)}, Error: {error}")
+        if error:
+            self.files_failed += 1
+            self.upload_failed.emit(f"{upload_name(path)}: {error}")
+        # Counted per saved attachment, like the saved count it is shown against
+        self.files_uploaded += saved
+        self.uploaded.emit(self.files_uploaded)
+
+    def on_mailbox_total(self, address, total):
+        self.mailbox_total.emit(address, total)
+        self.total.emit(sum(source.total for source in self.engine.sources))
+
+    def on_mailbox_progress(self, address, processed, found, saved):
+        # Called from the mailbox threads; the signals carry the totals over all mailboxes
+        self.counts[address] = (processed, found, saved)
+        self.mailbox_progress.emit(address, processed)
+        self.progress.emit(*(sum(column) for column in zip(*self.counts.values())))
+
+    def on_mailbox_done(self, address, error):
+        if error:
+            self.mailbox_failed.emit(address, error)
+
+    def process(self, start_date, destination_folder, config):
+        """Save new attachments of every mailbox and upload each one as soon as it is on disk."""
+        try:
+            self.ensure_session()
+            self.files_uploaded = 0
+            self.files_failed = 0
+            uploader = Uploader(upload_url(config),
+                                int(config.get("upload_workers", UPLOAD_WORKERS)),
+                                float(config.get("upload_rate", UPLOAD_RATE)),
+                                compression=config.get("upload_compression"),
+                                batch_bytes=int(config.get("upload_batch_bytes", BATCH_BYTES)))
+            queue_path = config.get("queue_path", QUEUE_PATH)
+            uploader.sent = SentIndex(config.get("sent_index_path", SENT_INDEX_PATH))
+            self.engine = MailboxEngine(self.mailbox_sources(config), uploader, destination_folder, queue_path,
+                                        on_total=self.on_mailbox_total, on_progress=self.on_mailbox_progress,
+                                        on_error=lambda address, error: self.failed.emit(f"{address}: {error}"),
+                                        on_done=self.on_mailbox_done, on_uploaded=self.on_uploaded)
+            self.counts = {source.address: (0, 0, 0) for source in self.engine.sources}
+            queue = JobQueue(queue_path)
+            try:
+                queue.prune()
+                queue.adopt(account.primary_smtp_address)
+            finally:
+                queue.close()
+            try:
+                # Jobs left over from an interrupted run come first in each mailbox
+                mailboxes_failed = self.engine.run(start_date, config.get("sync_state", True))
+                if uploader.skipped:
+                    print(f"Skipped {uploader.skipped} files whose content was already uploaded")
+                if self.engine.upload_error:
+                    raise RuntimeError(f"Upload Error: {self.engine.upload_error}")
+            finally:
+                uploader.sent.close()
+                uploader.close()
+            if not self.files_failed and not mailboxes_failed:
+                update_time_config()
+            # Saved files still waiting for their upload stay for the next run
+            queue = JobQueue(queue_path)
+            try:
+                keep = queue.unuploaded_files()
+            finally:
+                queue.close()
+            clear_directory_contents(destination_folder, keep)
+            self.finished.emit()
+        except Exception as e:
+            self.session.invalidate()  # Check the session again before the next run
+            self.error.emit(str(e))
+
+
+class EmailClientHandler(QObject):
+    """GUI side of the mail processing: timers and menu actions only queue jobs
+    for the MailService thread and show what its signals report."""
     global account, logged_in
+    session_check_requested = pyqtSignal()
+    process_requested = pyqtSignal(object, str, object)  # Start date, destination folder, config
 
     def __init__(self, tray_icon):
+        super().__init__()
         self.tray_icon = tray_icon
         self.progress_dialog = None  # Progress dialog instance
         self.total_emails = 0
@@ -489,65 +680,92 @@ class EmailClientHandler:
         self.total_attachments_found = 0
         self.total_attachments_saved = 0
         self.total_files_uploaded = 0
-        self.last_daily_run = None
-        self.daily_timer = QTimer()
-        self.daily_timer.timeout.connect(self.check_daily_task)
-        self.daily_timer.start(random.randint(50, 55) * 60 * 1000)
         self.start_time = None  # Track when processing starts
         self.total_emails = 0  # Track total emails in the current run
+        self.running = False
+        self.download_errors = []
+        self.upload_errors = []
+        self.mailbox_errors = []
+
+        self.service_thread = QThread()
+        self.service = MailService()
+        self.service.moveToThread(self.service_thread)
+        self.session_check_requested.connect(self.service.check_session)
+        self.process_requested.connect(self.service.process)
+        self.service.session_checked.connect(self.on_session_checked)
+        self.service.total.connect(self.on_download_total)
+        self.service.progress.connect(self.on_download_progress)
+        self.service.failed.connect(self.on_download_failed)
+        self.service.mailbox_total.connect(self.on_mailbox_total)
+        self.service.mailbox_progress.connect(self.on_mailbox_progress)
+        self.service.mailbox_failed.connect(self.on_mailbox_failed)
+        self.service.uploaded.connect(self.on_upload_progress)
+        self.service.upload_failed.connect(self.on_upload_failed)
+        self.service.finished.connect(self.on_finished)
+        self.service.error.connect(self.on_error)
+        self.service_thread.start()
+        QApplication.instance().aboutToQuit.connect(self.shutdown)
+
+        # One single-shot timer, armed for the next run (or the next wall clock check)
+        self.daily_timer = QTimer()
+        self.daily_timer.setSingleShot(True)
+        self.daily_timer.setTimerType(Qt.TimerType.PreciseTimer)
+        self.daily_timer.timeout.connect(self.check_daily_task)
+        self.load_schedule()
+        # Keep-alive: a cheap probe, and a fresh login in the background before the session expires
         self.session_check_timer = QTimer()
-        self.session_check_timer.timeout.connect(self.is_account_valid)
-        self.session_check_timer.start(3600000)  # Check every hour
+        self.session_check_timer.timeout.connect(self.session_check_requested.emit)
+        self.session_check_timer.start(int(self.service.session.keepalive * 1000))
+
+    def shutdown(self):
+        self.service.stop()
+        self.service_thread.quit()
+        self.service_thread.wait()
 
     def process_initial_run(self):
         global account
         if account:  # Only run if account is initialized
-            self.process_attachments()
-            time.sleep(60)
-            self.upload_attachments()
+            self.process_and_upload()
 
-    def is_account_valid(self):
-        global account, logged_in
-        try:
-            if not account or not logged_in:
-                return False
-            inbox = list(account.inbox.all().order_by('-datetime_received')[:10])  # Validate connection
-            return True
-        except Exception:
-            return False
+    def on_session_checked(self, valid, error):
+        if not valid and error:
+            self.tray_icon.showMessage("Re-authentication Failed", error,
+                                       QSystemTrayIcon.MessageIcon.Critical)
 
-    def handle_reauthentication(self):
+    def load_schedule(self):
+        """Read the schedule from config.json; a run missed while the app was closed is due at once."""
         try:
-            # Try re-login with stored credentials
-
-            self.login_window = LoginWindow(self.tray_icon)
-            self.login_window.load_encrypted_credentials()
-            self.login_window.attempt_basic_login()
+            with open("config.json", "r") as f:
+                config = json.load(f)
+            try:
+                self.schedule = Schedule.from_config(config)
+            except ValueError as e:
+                print(f"Invalid schedule, running daily at {self.tray_icon.schedule_hour}:00: {e}")
+                self.schedule = Schedule.from_config({**config, "schedule": daily(self.tray_icon.schedule_hour)})
+            print(f"Next scheduled run: {self.schedule.next_due:%Y-%m-%d %H:%M:%S}")
         except Exception as e:
-            self.tray_icon.showMessage(
-                "Re-authentication Failed",
-                f"Stored credentials invalid. Please check error.{e}",
-                QSystemTrayIcon.MessageIcon.Critical
-            )
+            print(f"Error loading schedule: {e}")
+            return
+        self.daily_timer.start(self.schedule.wait_ms())
 
     def check_daily_task(self):
-        global account, logged_in
         now = datetime.now()
-        current_date = QDate.currentDate()
-        self.is_account_valid()
-        if now.hour == self.tray_icon.schedule_hour and 0 <= now.minute < 60:
-            if not self.is_account_valid():
-                self.handle_reauthentication()
-                return
-            if self.last_daily_run == current_date:
+        if self.schedule.due(now):
+            # Checks the session and logs in again first if needed
+            if not self.process_and_upload():
+                self.daily_timer.start(RETRY_SECONDS * 1000)  # Still due; try again shortly
                 return
-            self.last_daily_run = current_date
-            self.process_attachments()
-            time.sleep(60)
-            self.upload_attachments()
+            self.schedule.mark_run(now)
+            print(f"Next scheduled run: {self.schedule.next_due:%Y-%m-%d %H:%M:%S}")
+        self.daily_timer.start(self.schedule.wait_ms())
 
-    def process_attachments(self):
+    def process_and_upload(self):
+        """Queue a run that saves new attachments and uploads each one as soon as it is saved.
+        Returns whether the run was started."""
         global account, logged_in
+        if self.running:
+            print("Mail processing already running")
+            return False
         try:
             if not account or not logged_in:
                 raise ValueError("Not authenticated with email server")
@@ -562,124 +780,103 @@ class EmailClientHandler:
             start_date = datetime.strptime(start_date_str, "%Y-%m-%d")
             if not os.path.exists(destination_folder):
                 os.makedirs(destination_folder)
-            all_emails = list(account.inbox.all().order_by('datetime_received'))
-            self.emails_to_process = [
-                email for email in all_emails
-                if email.datetime_received.replace(tzinfo=None) > start_date
-            ]
-            self.emails_to_process.sort(key=lambda email: email.datetime_received)
             self.destination_folder = destination_folder
             # Initialize logging variables
             self.start_time = datetime.now()
-            self.total_emails = len(self.emails_to_process)
-            self.log_run(type_process="Save Attachment")
             self.progress_dialog = ProgressDialog()
-            self.progress_dialog.set_phase("Processing Emails")
-            self.progress_dialog.set_total_emails(len(self.emails_to_process))
+            self.progress_dialog.set_phase("Processing Emails and Uploading Files")
             self.progress_dialog.show()
 
-            # Start processing
-            self.process_next_email()
+            # Download and upload on the service thread; progress comes back through signals
+            self.running = True
+            self.download_errors = []
+            self.upload_errors = []
+            self.mailbox_errors = []
+            self.total_files_uploaded = 0
+            self.process_requested.emit(start_date, destination_folder, config)
+            return True
         except Exception as e:
-            self.progress_dialog.close()
+            self.running = False
+            if self.progress_dialog:
+                self.progress_dialog.close()
             error_msg = f"Processing Error: {str(e)}"
             print(error_msg)
             self.tray_icon.showMessage("Processing Failed", error_msg,
                                        QSystemTrayIcon.MessageIcon.Critical)
             # Log the error
             self.log_run(type_process="Save Attachment", error=error_msg)
+            return False
 
-    def process_next_email(self):
-        if not self.emails_to_process:
-            self.tray_icon.showMessage("Processing Complete",
-                                       "All emails attachments were saved.",
-                                       QSystemTrayIcon.MessageIcon.Information)
-            return
-        email = self.emails_to_process.pop(0)
-        self.processed_emails += 1
-        try:
-            # Process attachments
-            for attachment in email.attachments:
-                self.total_attachments_found += 1
-                if isinstance(attachment, FileAttachment) and attachment.name.lower().endswith(
-                        ('.xlsx', '.xls', '.csv')):
-                    file_path = os.path.join(self.destination_folder, attachment.name)
-                    with open(file_path, 'wb') as f:
-                        f.write(attachment.content)
-                    self.total_attachments_saved += 1
-
-            # Update progress dialog
-            self.progress_dialog.update_email_progress(self.processed_emails)
-            self.progress_dialog.update_attachment_counts(
-                self.total_attachments_found,
-                self.total_attachments_saved
-            )
-            time.sleep(5)
-            self.process_next_email()
-        except Exception as e:
-            self.progress_dialog.set_phase(f"Error: {str(e)}")
-            error_msg = f"Attachment Error: {str(e)}"
-            print(error_msg)
-            self.tray_icon.showMessage("Attachment Failed", error_msg,
+    def on_download_total(self, total):
+        self.total_emails = total
+        self.progress_dialog.set_total_emails(total)
+
+    def on_mailbox_total(self, address, total):
+        self.progress_dialog.update_mailbox(address, 0, total)
+
+    def on_mailbox_progress(self, address, processed):
+        self.progress_dialog.update_mailbox(address, processed)
+
+    def on_mailbox_failed(self, address, error):
+        error_msg = f"Mailbox Error: {address}: {error}"
+        print(error_msg)
+        self.mailbox_errors.append(error_msg)
+        self.progress_dialog.update_mailbox(address, error=error)
+
+    def on_download_progress(self, processed, found, saved):
+        self.processed_emails = processed
+        self.total_attachments_found = found
+        self.total_attachments_saved = saved
+        self.progress_dialog.update_email_progress(processed)
+        self.progress_dialog.update_attachment_counts(found, saved)
+        self.progress_dialog.update_upload_counts(self.total_files_uploaded, saved)
+
+    def on_download_failed(self, error):
+        error_msg = f"Attachment Error: {error}"
+        print(error_msg)
+        self.download_errors.append(error_msg)
+
+    def on_upload_progress(self, uploaded):
+        self.total_files_uploaded = uploaded
+        self.progress_dialog.update_upload_counts(uploaded, self.total_attachments_saved)
+
+    def on_upload_failed(self, error):
+        self.upload_errors.append(error)
+
+    def on_finished(self):
+        self.running = False
+        self.log_run(type_process="Save Attachment")
+        if self.mailbox_errors:
+            self.tray_icon.showMessage("Mailbox Failed",
+                                       f"{len(self.mailbox_errors)} mailboxes could not be processed: "
+                                       f"{self.mailbox_errors[0]}",
                                        QSystemTrayIcon.MessageIcon.Warning)
-
-    def upload_attachments(self):
-        upload_Done = True
-        try:
-            with open("config.json", "r") as f:
-                config = json.load(f)
-
-            destination_folder = config.get("destination_folder")
-            destination_folder = os.path.join(os.getcwd(), destination_folder)
-            files = os.listdir(destination_folder)
-            total_files = len(files)
-            self.progress_dialog.set_phase("Uploading Files")
-            self.progress_dialog.set_upload_total(total_files)
-            for i, file in enumerate(files, 1):
-                full_path = os.path.join(destination_folder, file)
-                if True:
-                    url = "https://bi.mci.ir/myflask/upload"
-
-                    # Use the full path to the file
-                    with open(full_path, 'rb') as f:
-                        response = requests.post(url, files={'file': f}, verify=False)
-
-                    print(response.status_code)
-                    print(response.json())
-                    if response.status_code != 200:
-                        upload_Done = False
-                        error_msg_upload = response.text
-                        print(error_msg_upload)
-
-                    time.sleep(15)
-                    os.remove(full_path)
-                    self.total_files_uploaded += 1
-                    self.progress_dialog.update_upload_progress(i)
-            if upload_Done:
-                update_time_config()
-
-                self.tray_icon.showMessage("Upload Complete",
-                                           "Files uploaded successfully",
-                                           QSystemTrayIcon.MessageIcon.Information)
-                self.log_run(type_process="Upload")
-            else:
-
-                self.tray_icon.showMessage("Upload Failed", error_msg_upload,
-                                           QSystemTrayIcon.MessageIcon.Critical)
-                self.log_run(type_process="Upload", error=error_msg_upload)
-            clear_directory_contents(destination_folder)
-            self.progress_dialog.close()
-
-        except Exception as e:
-            error_msg = f"Upload Error: {str(e)}"
-            print(error_msg)
-            self.tray_icon.showMessage("Upload Failed", error_msg,
+            self.log_run(type_process="Save Attachment", error="; ".join(self.mailbox_errors))
+        if self.download_errors:
+            self.tray_icon.showMessage("Attachment Failed",
+                                       f"{len(self.download_errors)} attachments could not be saved: "
+                                       f"{self.download_errors[0]}",
+                                       QSystemTrayIcon.MessageIcon.Warning)
+            self.log_run(type_process="Save Attachment", error="; ".join(self.download_errors))
+        if self.upload_errors:
+            self.tray_icon.showMessage("Upload Failed", self.upload_errors[0],
                                        QSystemTrayIcon.MessageIcon.Critical)
-            self.log_run(type_process="Upload", error=error_msg)
-            try:
-                self.progress_dialog.close()
-            except:
-                pass
+            self.log_run(type_process="Upload", error="; ".join(self.upload_errors))
+        else:
+            self.tray_icon.showMessage("Upload Complete",
+                                       "Files uploaded successfully",
+                                       QSystemTrayIcon.MessageIcon.Information)
+            self.log_run(type_process="Upload")
+        self.progress_dialog.close()
+
+    def on_error(self, error):
+        self.running = False
+        self.progress_dialog.set_phase(f"Error: {error}")
+        error_msg = f"Processing Error: {error}"
+        print(error_msg)
+        self.tray_icon.showMessage("Processing Failed", error_msg,
+                                   QSystemTrayIcon.MessageIcon.Critical)
+        self.log_run(type_process="Save Attachment", error=error_msg)
 
     def log_run(self, type_process=None, error=None):
         """Logs the runtime and number of emails processed"""
@@ -688,7 +885,7 @@ class EmailClientHandler:
         else:
             count = self.total_attachments_saved
         log_entry = (
-            f"{type_process} - {self.start_time.strftime('%Y-%m-%d %H:%M:%S')} - "
+            f"{type_process} - {(self.start_time or datetime.now()).strftime('%Y-%m-%d %H:%M:%S')} - "
             f"Processed {count} (emails/files)"
         )
         if error:
@@ -798,13 +995,17 @@ class ProgressDialog(QDialog):
         self.email_label = QLabel("Emails processed: 0/0", self)
         self.attachment_found_label = QLabel("Attachments found: 0", self)
         self.attachment_saved_label = QLabel("Attachments saved: 0", self)
-        self.uploaded_label = QLabel("Files uploaded: 0/0", self)
+        self.uploaded_label = QLabel("Attachments uploaded: 0/0", self)
 
         self.layout.addWidget(self.email_label)
         self.layout.addWidget(self.attachment_found_label)
         self.layout.addWidget(self.attachment_saved_label)
         self.layout.addWidget(self.uploaded_label)
 
+        # One line per mailbox, added as the mailboxes report
+        self.mailbox_labels = {}
+        self.mailbox_totals = {}
+
         self.setLayout(self.layout)
 
     def set_phase(self, phase_text):
@@ -822,14 +1023,20 @@ class ProgressDialog(QDialog):
         self.attachment_found_label.setText(f"Attachments found: {found}")
         self.attachment_saved_label.setText(f"Attachments saved: {saved}")
 
-    def set_upload_total(self, total):
-        self.progress_bar.setMaximum(total)
-        self.progress_bar.setValue(0)
-        self.uploaded_label.setText(f"Files uploaded: 0/{total}")
+    def update_upload_counts(self, uploaded, saved):
+        self.uploaded_label.setText(f"Attachments uploaded: {uploaded}/{saved}")
 
-    def update_upload_progress(self, uploaded):
-        self.progress_bar.setValue(uploaded)
-        self.uploaded_label.setText(f"Files uploaded: {uploaded}/{self.progress_bar.maximum()}")
+    def update_mailbox(self, address, processed=0, total=None, error=None):
+        if address not in self.mailbox_labels:
+            self.mailbox_labels[address] = QLabel(self)
+            self.layout.addWidget(self.mailbox_labels[address])
+        if total is not None:
+            self.mailbox_totals[address] = total
+        if error:
+            self.mailbox_labels[address].setText(f"{address}: failed ({error})")
+        else:
+            self.mailbox_labels[address].setText(
+                f"{address}: {processed}/{self.mailbox_totals.get(address, 0)} emails")
 
 
 class InboxViewer(QMainWindow):
@@ -908,17 +1115,21 @@ def update_time_config():
 import os
 
 
-def clear_directory_contents(target_dir):
-    """Remove all files and subdirectories within a directory, but keep the directory itself."""
+def clear_directory_contents(target_dir, keep=()):
+    """Remove all files and subdirectories within a directory, but keep the directory
+    itself and the files in keep."""
+    keep = {os.path.normcase(os.path.abspath(path)) for path in keep}
     for root, dirs, files in os.walk(target_dir, topdown=False):
         # Remove all files
         for file in files:
             file_path = os.path.join(root, file)
+            if os.path.normcase(os.path.abspath(file_path)) in keep:
+                continue
             os.remove(file_path)
             print(f"Deleted file: {file_path}")
 
         # Remove subdirectories (except the target directory itself)
-        if root != target_dir:
+        if root != target_dir and not os.listdir(root):
             os.rmdir(root)
             print(f"Deleted directory: {root}")
 
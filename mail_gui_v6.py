@@ -1,19 +1,21 @@
 import os
 import sys
 import json
-import time
-import random
+from queue import Queue
+from collections import Counter
 from datetime import datetime, timedelta
-import requests
 from PyQt6.QtWidgets import (
-    QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QLabel,
-    QLineEdit, QPushButton, QTextEdit, QListWidget, QMessageBox, QFileDialog,
-    QStackedWidget, QSystemTrayIcon, QMenu, QDialog
+    QApplication, QVBoxLayout, QLabel, QMessageBox, QSystemTrayIcon, QMenu, QDialog, QProgressBar, QInputDialog
 )
-from PyQt6.QtCore import pyqtSignal, QTimer, Qt
-from PyQt6.QtGui import QIcon, QPixmap
+from PyQt6.QtCore import pyqtSignal, QTimer, Qt, QThread, QObject
+from PyQt6.QtGui import QAction, QIcon, QPixmap
 import pythoncom
 import win32com.client
+from mail_schedule import RETRY_SECONDS, Schedule, daily
+from mail_upload import (
+    BATCH_BYTES, IDLE, PIPELINE_DEPTH, SENT_INDEX_PATH, UPLOAD_RATE, UPLOAD_WORKERS, SentIndex, Uploader,
+    content_name, file_digest, iter_queue, upload_name, upload_url
+)
 
 # Constants
 APP_NAME = "Outlook Attachment Processor"
@@ -37,21 +39,136 @@ def ensure_com_initialized():
         COM_INITIALIZED = True
 
 
+class UploadWorker(QObject):
+    """Uploads the paths put on paths_queue until None arrives; uploaded files are deleted."""
+    uploaded = pyqtSignal(int, int)  # Paths done (one per time a path was put on the queue), files failed
+    finished = pyqtSignal(str)  # Fatal error, or "" when the run completed
+
+    def __init__(self, paths_queue):
+        super().__init__()
+        self.paths_queue = paths_queue
+        self.done = 0
+        self.failed = 0
+        self.handed = Counter()  # Path -> times put on the queue and not reported yet
+
+    def handed_over(self, paths):
+        # One content file can hold several saved attachments and arrive once for
+        # each, while the uploader reports it once; done counts every arrival
+        for path in paths:
+            if path is not IDLE:
+                self.handed[path] += 1
+            yield path
+
+    def on_result(self, full_path, error):
+        print(f"Uploaded: {upload_name(full_path)}, Error: {error}")
+        if error:
+            self.failed += 1
+        elif os.path.exists(full_path):
+            os.remove(full_path)
+        self.done += self.handed.pop(full_path, 0)
+        self.uploaded.emit(self.done, self.failed)
+
+    def run(self):
+        paths = self.handed_over(iter_queue(self.paths_queue))
+        sent = SentIndex(config.get("sent_index_path", SENT_INDEX_PATH))
+        uploader = Uploader(upload_url(config),
+                            int(config.get("upload_workers", UPLOAD_WORKERS)),
+                            float(config.get("upload_rate", UPLOAD_RATE)),
+                            on_result=self.on_result,
+                            compression=config.get("upload_compression"),
+                            batch_bytes=int(config.get("upload_batch_bytes", BATCH_BYTES)),
+                            sent=sent)
+        try:
+            uploader.run(paths)
+            if uploader.skipped:
+                print(f"Skipped {uploader.skipped} files whose content was already uploaded")
+            self.finished.emit("")
+        except Exception as e:
+            for _ in paths:  # Keep process_attachments from blocking on a full queue
+                pass
+            self.finished.emit(str(e))
+        finally:
+            uploader.close()
+            sent.close()
+
+
+class OutlookWorker(QObject):
+    """Saves the attachments of emails received after start_date on its own thread,
+    with its own Outlook connection: COM objects belong to the thread that made them."""
+    total = pyqtSignal(int)  # Emails to process
+    progress = pyqtSignal(int, int)  # Emails processed, attachments saved
+    finished = pyqtSignal(int, str)  # Attachments saved, fatal error or ""
+
+    def __init__(self, start_date, saved_queue=None):
+        super().__init__()
+        self.start_date = start_date
+        self.saved_queue = saved_queue  # Saved paths go here for the upload worker
+
+    def run(self):
+        pythoncom.CoInitialize()
+        saved_attachments = 0
+        try:
+            inbox = win32com.client.Dispatch("Outlook.Application").GetNamespace("MAPI").GetDefaultFolder(6)
+
+            # Format date for DASL query
+            query = f"@SQL=(\"urn:schemas:httpmail:datereceived\" > '{self.start_date}')"
+            messages = inbox.Items.Restrict(query)
+            self.total.emit(messages.Count)
+
+            # Process each email
+            processed = 0
+            for i, msg in enumerate(messages, 1):
+                try:
+                    print(f"[{i}] Processing email: '{msg.Subject}' from {msg.SenderName}")
+                    attachments = msg.Attachments
+
+                    for j, attachment in enumerate(attachments, 1):
+                        filename = attachment.FileName
+                        if filename.lower().endswith(('.xlsx', '.xls', '.csv')):
+                            # Named after the content: same-named reports never overwrite each other
+                            part_path = os.path.join(SAVE_PATH, f"{os.getpid()}_{i}_{j}.part")
+                            attachment.SaveAsFile(part_path)
+                            file_path = os.path.join(SAVE_PATH, content_name(filename, file_digest(part_path)))
+                            os.replace(part_path, file_path)
+                            saved_attachments += 1
+                            print(f"  [{j}] Saved attachment: {filename}")
+                            if self.saved_queue is not None:
+                                self.saved_queue.put(file_path)  # Waits while the uploads are behind
+
+                    processed += 1
+                    self.progress.emit(processed, saved_attachments)
+                except Exception as e:
+                    print(f"Error processing email: {e}")
+            self.finished.emit(saved_attachments, "")
+        except Exception as e:
+            self.finished.emit(saved_attachments, str(e))
+        finally:
+            if self.saved_queue is not None:
+                self.saved_queue.put(None)  # The upload worker finishes the run
+            pythoncom.CoUninitialize()
+
+
 class OutlookClientHandler:
     def __init__(self, tray_icon):
         self.tray_icon = tray_icon
         self.progress_dialog = None
         self.load_config()
 
+        self.running = False
+        self.uploading = False
+        self.saved_attachments = None  # Attachments saved so far while processing and uploading together
+
         # Initialize Outlook
         self.outlook = None
         self.inbox = None
         self.connect_to_outlook()
 
-        # Schedule daily task
+        # Schedule daily task: one single-shot timer, armed for the next run (or the next wall clock check)
         self.daily_timer = QTimer()
+        self.daily_timer.setSingleShot(True)
+        self.daily_timer.setTimerType(Qt.TimerType.PreciseTimer)
         self.daily_timer.timeout.connect(self.check_daily_task)
-        self.daily_timer.start(random.randint(50, 55) * 60 * 1000)
+        self.load_schedule()
 
     def connect_to_outlook(self):
         try:
@@ -75,64 +192,122 @@ class OutlookClientHandler:
         self.tray_icon.showMessage(title, message, QSystemTrayIcon.MessageIcon.Critical)
         print(f"{title}: {message}")
 
+    def load_schedule(self):
+        """Read the schedule from config.json; a run missed while the app was closed is due at once."""
+        try:
+            with open(CONFIG_FILE, "r") as f:
+                config = json.load(f)
+            try:
+                self.schedule = Schedule.from_config(config)
+            except ValueError as e:
+                print(f"Invalid schedule, running daily at {self.schedule_hour}:00: {e}")
+                self.schedule = Schedule.from_config({**config, "schedule": daily(self.schedule_hour)})
+            print(f"Next scheduled run: {self.schedule.next_due:%Y-%m-%d %H:%M:%S}")
+        except Exception as e:
+            self.show_error("Schedule Error", str(e))
+            return
+        self.daily_timer.start(self.schedule.wait_ms())
+
     def check_daily_task(self):
         now = datetime.now()
-        if now.hour == self.schedule_hour and now.minute < 5:
-            self.process_attachments()
-            time.sleep(60)
-            self.upload_attachments()
-
-    def process_attachments(self):
+        if self.schedule.due(now):
+            if not self.process_attachments(upload=True):
+                self.daily_timer.start(RETRY_SECONDS * 1000)  # Still due; try again shortly
+                return
+            self.schedule.mark_run(now)
+            print(f"Next scheduled run: {self.schedule.next_due:%Y-%m-%d %H:%M:%S}")
+        self.daily_timer.start(self.schedule.wait_ms())
+
+    def start_upload(self, paths_queue):
+        """Start the upload worker; paths put on paths_queue go up while more are being saved."""
+        self.upload_failed = 0
+        self.upload_thread = QThread()
+        self.upload_worker = UploadWorker(paths_queue)
+        self.upload_worker.moveToThread(self.upload_thread)
+        self.upload_thread.started.connect(self.upload_worker.run)
+        self.upload_worker.uploaded.connect(self.on_upload_progress)
+        self.upload_worker.finished.connect(self.on_upload_finished)
+        self.upload_worker.finished.connect(self.upload_thread.quit)
+        self.upload_worker.finished.connect(self.upload_worker.deleteLater)
+        self.upload_thread.finished.connect(self.upload_thread.deleteLater)
+        self.upload_thread.start()
+
+    def on_upload_progress(self, done, failed):
+        self.upload_failed = failed
+        if self.saved_attachments is None:  # Uploading files saved earlier
+            self.progress_dialog.update_upload_progress(done)
+        else:
+            self.progress_dialog.update_upload_counts(done, self.saved_attachments)
+
+    def on_upload_finished(self, error):
+        self.running = False
+        self.progress_dialog.close()
+        if error:
+            self.show_error("Upload Error", error)
+        elif not self.upload_failed:
+            self.show_info("Upload Success", "All files uploaded successfully.")
+        else:
+            self.show_error("Upload Failed", "Some files failed to upload.")
+
+    def process_attachments(self, upload=False):
+        """Save attachments of new emails in the background; with upload, each one is
+        uploaded as soon as it is saved. Returns whether the run was started."""
+        if self.running:
+            print("Mail processing already running")
+            return False
         try:
             os.makedirs(SAVE_PATH, exist_ok=True)
-
-            # Format date for DASL query
-            date_str = self.start_date
-            query = f"@SQL=(\"urn:schemas:httpmail:datereceived\" > '{date_str}')"
-            messages = self.inbox.Items.Restrict(query)
-
-            if messages.Count == 0:
-                self.show_info("No Emails", "No emails found after the specified date.")
-                return
+            self.running = True
+            self.uploading = upload
+            self.saved_attachments = 0 if upload else None
 
             # Show progress dialog
             self.progress_dialog = ProgressDialog()
-            self.progress_dialog.set_phase("Processing Emails")
-            self.progress_dialog.set_total_emails(messages.Count)
+            self.progress_dialog.set_phase("Processing Emails and Uploading Files" if upload else "Processing Emails")
             self.progress_dialog.show()
 
-            # Process each email
-            processed = 0
-            total_attachments = 0
-            saved_attachments = 0
-
-            for i, msg in enumerate(messages, 1):
-                try:
-                    print(f"[{i}] Processing email: '{msg.Subject}' from {msg.SenderName}")
-                    attachments = msg.Attachments
-
-                    for j, attachment in enumerate(attachments, 1):
-                        filename = attachment.FileName
-                        if filename.lower().endswith(('.xlsx', '.xls', '.csv')):
-                            file_path = os.path.join(SAVE_PATH, filename)
-                            attachment.SaveAsFile(file_path)
-                            saved_attachments += 1
-                            self.progress_dialog.update_attachment_counts(total_attachments, saved_attachments)
-                            print(f"  [{j}] Saved attachment: {filename}")
-
-                    processed += 1
-                    self.progress_dialog.update_email_progress(processed)
-                except Exception as e:
-                    print(f"Error processing email: {e}")
-
-            self.progress_dialog.close()
-            self.show_info("Processing Complete", f"Saved {saved_attachments} attachments.")
-
-            # Update config date
-            self.update_start_date()
+            saved_queue = Queue(PIPELINE_DEPTH) if upload else None
+            if upload:
+                self.start_upload(saved_queue)
+            self.outlook_thread = QThread()
+            self.outlook_worker = OutlookWorker(self.start_date, saved_queue)
+            self.outlook_worker.moveToThread(self.outlook_thread)
+            self.outlook_thread.started.connect(self.outlook_worker.run)
+            self.outlook_worker.total.connect(self.progress_dialog.set_total_emails)
+            self.outlook_worker.progress.connect(self.on_processing_progress)
+            self.outlook_worker.finished.connect(self.on_processing_finished)
+            self.outlook_worker.finished.connect(self.outlook_thread.quit)
+            self.outlook_worker.finished.connect(self.outlook_worker.deleteLater)
+            self.outlook_thread.finished.connect(self.outlook_thread.deleteLater)
+            self.outlook_thread.start()
+            return True
 
         except Exception as e:
+            self.running = False
             self.show_error("Processing Failed", str(e))
+            if self.progress_dialog:
+                self.progress_dialog.close()
+            return False
+
+    def on_processing_progress(self, processed, saved):
+        if self.saved_attachments is not None:
+            self.saved_attachments = saved
+        self.progress_dialog.update_email_progress(processed)
+        self.progress_dialog.update_attachment_counts(0, saved)
+
+    def on_processing_finished(self, saved, error):
+        if error:
+            self.show_error("Processing Failed", error)
+        elif not self.progress_dialog.progress_bar.maximum():
+            self.show_info("No Emails", "No emails found after the specified date.")
+        else:
+            self.show_info("Processing Complete", f"Saved {saved} attachments.")
+            # Update config date
+            self.update_start_date()
+        if self.uploading:
+            self.progress_dialog.set_phase("Uploading Files")  # The upload worker finishes the run
+        else:
+            self.running = False
             self.progress_dialog.close()
 
     def update_start_date(self):
@@ -151,52 +326,33 @@ class OutlookClientHandler:
             print(f"Failed to update start date: {e}")
 
     def upload_attachments(self):
-
+        if self.running:
+            print("Mail processing already running")
+            return
         try:
-            files = os.listdir(SAVE_PATH)
+            files = [file for file in os.listdir(SAVE_PATH) if not file.endswith(".part")]
             if not files:
                 self.show_info("No Files", "No files to upload.")
                 return
 
+            self.running = True
+            self.saved_attachments = None
             self.progress_dialog = ProgressDialog()
             self.progress_dialog.set_phase("Uploading Files")
             self.progress_dialog.set_upload_total(len(files))
             self.progress_dialog.show()
-
-            uploaded = 0
-            upload_done = True
-
+            # Everything is on disk already, so the queue needs no bound
+            paths_queue = Queue()
             for file in files:
-                full_path = os.path.join(SAVE_PATH, file)
-                try:
-                    with open(full_path, 'rb') as f:
-                        response = requests.post(
-                            "https://bi.mci.ir/myflask/upload",
-                            files={'file': f},
-                            verify=False
-                        )
-                        print(f"Uploaded: {file}, Status: {response.status_code}")
-                        if response.status_code != 200:
-                            upload_done = False
-
-                    os.remove(full_path)
-                    uploaded += 1
-                    self.progress_dialog.update_upload_progress(uploaded)
-                    time.sleep(1)
-
-                except Exception as e:
-                    print(f"Upload error for {file}: {e}")
-                    upload_done = False
-
-            self.progress_dialog.close()
-            if upload_done:
-                self.show_info("Upload Success", "All files uploaded successfully.")
-            else:
-                self.show_error("Upload Failed", "Some files failed to upload.")
+                paths_queue.put(os.path.join(SAVE_PATH, file))
+            paths_queue.put(None)
+            self.start_upload(paths_queue)
 
         except Exception as e:
+            self.running = False
             self.show_error("Upload Error", str(e))
-            self.progress_dialog.close()
+            if self.progress_dialog:
+                self.progress_dialog.close()
 
     def show_info(self, title, message):
         self.tray_icon.showMessage(title, message, QSystemTrayIcon.MessageIcon.Information)
@@ -252,6 +408,9 @@ class ProgressDialog(QDialog):
         self.progress_bar.setValue(uploaded)
         self.uploaded_label.setText(f"Files uploaded: {uploaded}/{self.progress_bar.maximum()}")
 
+    def update_upload_counts(self, uploaded, saved):
+        self.uploaded_label.setText(f"Attachments uploaded: {uploaded}/{saved}")
+
 
 class TrayIcon(QSystemTrayIcon):
     def __init__(self, parent=None):
@@ -291,9 +450,11 @@ class TrayIcon(QSystemTrayIcon):
             with open(CONFIG_FILE, "r+") as f:
                 config = json.load(f)
                 config["schedule_hour"] = hour
+                config["schedule"] = daily(hour)
                 f.seek(0)
                 json.dump(config, f, indent=2)
                 f.truncate()
+            self.email_client.load_schedule()
 
     def process_mail(self):
         self.email_client.process_attachments()
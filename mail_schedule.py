@@ -0,0 +1,163 @@
+"""When the mail attachment aggregators run (mail_gui_v5.py, mail_gui_v6.py).
+
+A cron expression gives the fire times; each run is delayed by a random jitter
+of up to `jitter` seconds. The next due time is kept in a small JSON file, so
+a run missed while the app was closed or the machine slept is made up once at
+the next check instead of being skipped. No Qt: the apps arm a single-shot
+timer for wait_ms() and call due() when it fires.
+"""
+import os
+import json
+import random
+import tempfile
+from datetime import datetime, timedelta
+
+STATE_PATH = "schedule_state.json"
+JITTER_SECONDS = 300
+# Longest single wait; timers can be late after sleep or hibernation, so the
+# wall clock is looked at again at least this often.
+MAX_WAIT_SECONDS = 15 * 60
+RETRY_SECONDS = 5 * 60  # A due run that could not start (another run going, not logged in) is tried again after this
+FIELDS = (  # name, lowest, highest
+    ("minute", 0, 59),
+    ("hour", 0, 23),
+    ("day of month", 1, 31),
+    ("month", 1, 12),
+    ("day of week", 0, 7),  # 0 and 7 are both Sunday
+)
+
+
+def daily(hour, minute=0):
+    return f"{minute} {hour} * * *"
+
+
+def schedule_expression(config):
+    """The config's "schedule" cron expression, else daily at "schedule_hour"."""
+    return config.get("schedule") or daily(config.get("schedule_hour", 8))
+
+
+def parse_field(text, name, lowest, highest):
+    """Values allowed by one cron field: *, n, a-b, lists and /step."""
+    values = set()
+    for part in text.split(","):
+        spec, _, step = part.partition("/")
+        if spec == "*":
+            start, end = lowest, highest
+        elif "-" in spec:
+            start, end = (int(v) for v in spec.split("-", 1))
+        else:
+            start = end = int(spec)
+            if step:
+                end = highest
+        step = int(step) if step else 1
+        if not (lowest <= start <= end <= highest) or step < 1:
+            raise ValueError(f"Bad {name} in schedule: {part!r}")
+        values.update(range(start, end + 1, step))
+    if name == "day of week" and 7 in values:
+        values = (values - {7}) | {0}
+    return values
+
+
+class CronExpression:
+    """Five-field cron expression (minute hour day-of-month month day-of-week).
+
+    As in cron, when both day fields are restricted a day matching either counts.
+    """
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Schedule needs 5 fields (minute hour day month weekday): {expression!r}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            parse_field(text, *spec) for text, spec in zip(fields, FIELDS))
+        # Like cron, a field starting with * (also */N) does not restrict the day
+        self.any_day = fields[2].startswith("*")
+        self.any_weekday = fields[4].startswith("*")
+
+    def day_matches(self, day):
+        if day.month not in self.months:
+            return False
+        in_month = day.day in self.days
+        in_week = (day.isoweekday() % 7) in self.weekdays
+        if self.any_day or self.any_weekday:
+            return in_month and in_week
+        return in_month or in_week
+
+    def next_after(self, moment):
+        """First fire time strictly after moment (naive local time)."""
+        start = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.replace(hour=0, minute=0)
+        for _ in range(366 * 8):  # Covers Feb 29 and weekday combinations
+            if self.day_matches(day):
+                for hour in sorted(self.hours):
+                    for minute in sorted(self.minutes):
+                        fire = day.replace(hour=hour, minute=minute)
+                        if fire >= start:
+                            return fire
+            day += timedelta(days=1)
+        raise ValueError(f"Schedule never fires: {self.expression!r}")
+
+
+class Schedule:
+    """Cron schedule with jitter and a persisted next due time.
+
+    due(now) is true from the next due time on until mark_run(); runs missed
+    in between are made up by that one run.
+    """
+
+    def __init__(self, expression, jitter=JITTER_SECONDS, state_path=STATE_PATH):
+        self.cron = CronExpression(expression)
+        self.jitter = jitter
+        self.state_path = state_path
+        self.last_run = None
+        self.next_due = None
+        self.load()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(schedule_expression(config), float(config.get("schedule_jitter_seconds", JITTER_SECONDS)),
+                   config.get("schedule_state_path", STATE_PATH))
+
+    def load(self):
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = {}
+        if state.get("last_run"):
+            self.last_run = datetime.fromisoformat(state["last_run"])
+        same_schedule = state.get("expression") == self.cron.expression
+        if same_schedule and state.get("next_due"):
+            self.next_due = datetime.fromisoformat(state["next_due"])
+        else:
+            # Same schedule without a due time: catch up from the last run. A new
+            # schedule starts from now; its fire times before now were never due.
+            self.next_due = self.fire_after(self.last_run if same_schedule and self.last_run else datetime.now())
+            self.save()
+
+    def save(self):
+        state = {"expression": self.cron.expression,
+                 "last_run": self.last_run.isoformat() if self.last_run else None,
+                 "next_due": self.next_due.isoformat()}
+        folder = os.path.dirname(os.path.abspath(self.state_path))
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=folder)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=4)
+        os.replace(tmp, self.state_path)
+
+    def fire_after(self, moment):
+        return self.cron.next_after(moment) + timedelta(seconds=random.uniform(0, self.jitter))
+
+    def due(self, now=None):
+        return (now or datetime.now()) >= self.next_due
+
+    def mark_run(self, now=None):
+        self.last_run = now or datetime.now()
+        self.next_due = self.fire_after(self.last_run)
+        self.save()
+
+    def wait_ms(self, now=None):
+        """Milliseconds until the timer should look again."""
+        seconds = (self.next_due - (now or datetime.now())).total_seconds()
+        return int(max(0, min(seconds, MAX_WAIT_SECONDS)) * 1000)
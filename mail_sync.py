@@ -0,0 +1,650 @@
+"""Mailbox side of the MCI mail attachment aggregator.
+
+Kept free of Qt so the same code runs from the tray app, headless, or against a
+local EWS stand-in (point "ews_endpoint" in config.json at it).
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import itertools
+import tempfile
+import threading
+from functools import partial
+from queue import Queue
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from exchangelib import UTC, EWSDateTime, FileAttachment
+from exchangelib.errors import ErrorInvalidSyncStateData
+from exchangelib.items import ID_ONLY
+from exchangelib.services import GetFolder
+from mail_upload import PIPELINE_DEPTH, STOPPED, RateLimiter, content_name, iter_queue
+
+DEFAULT_EWS_ENDPOINT = "https://mail.mci.ir/ews/exchange.asmx"
+ATTACHMENT_EXTENSIONS = ('.xlsx', '.xls', '.csv')
+# Fields the aggregator reads from each message; everything else stays on the server.
+# Listing needs FindItem only; attachment lists are fetched with GetItem per queued batch.
+MESSAGE_FIELDS = ("datetime_received", "subject")
+ATTACHMENT_FIELDS = ("subject", "attachments")
+SYNC_FIELDS = ("datetime_received", "subject", "has_attachments")
+PAGE_SIZE = 100  # Message IDs per FindItem request
+SYNC_PAGE_SIZE = 512  # Changes per SyncFolderItems request (the EWS maximum)
+CHUNK_SIZE = 25  # Messages per GetItem request (attachment lists are larger)
+QUEUE_PATH = "mail_queue.sqlite3"
+MAX_ATTEMPTS = 3  # A failed message is retried on later runs until it failed this often
+PRUNE_DAYS = 30  # Uploaded messages are forgotten after this long
+DOWNLOAD_WORKERS = 4
+DOWNLOAD_RATE = 2.0  # Attachment downloads started per second; 0 means no limit
+MAX_CONNECTIONS = 4  # EWS connections per login, shared by the mailboxes opened with it
+COPY_BUFFER = 1024 * 1024
+SESSION_TTL = 300  # A working session is trusted this long without asking the server again
+SESSION_LIFETIME = 8 * 3600  # Log in again before a session gets this old
+SESSION_KEEPALIVE = 900  # Seconds between background session checks
+
+
+def ews_endpoint(config):
+    return config.get("ews_endpoint") or DEFAULT_EWS_ENDPOINT
+
+
+def attachment_messages(folder, start_date, page_size=PAGE_SIZE):
+    """Messages with attachments received after start_date (naive, UTC), oldest first.
+
+    The date and has_attachments filters run on the server and only MESSAGE_FIELDS
+    are fetched. The query is lazy: pages are requested as the result is iterated,
+    so nothing is held beyond the current page.
+    """
+    since = EWSDateTime.from_datetime(start_date.replace(tzinfo=UTC))
+    query = folder.filter(datetime_received__gt=since, has_attachments=True)
+    query = query.only(*MESSAGE_FIELDS).order_by("datetime_received")
+    query.page_size = page_size
+    return query
+
+
+def changed_messages(folder, sync_state, page_size=SYNC_PAGE_SIZE):
+    """Messages with attachments created in folder since sync_state, in the order the server reports them.
+
+    Once the result is fully consumed, folder.item_sync_state holds the state to
+    continue from next time.
+    """
+    folder.item_sync_state = sync_state
+    for change_type, item in folder.sync_items(only_fields=SYNC_FIELDS, max_changes_returned=page_size):
+        if change_type == "create" and item.has_attachments:
+            yield item
+
+
+def current_sync_state(folder, page_size=SYNC_PAGE_SIZE):
+    """A sync state covering everything in folder now.
+
+    SyncFolderItems cannot start from a date, so the folder is walked once with
+    item IDs only (no fields) and the changes are dropped.
+    """
+    folder.item_sync_state = None
+    for _ in folder.sync_items(only_fields=(), max_changes_returned=page_size):
+        pass
+    return folder.item_sync_state
+
+
+def queue_new_messages(queue, folder, key, start_date, use_sync_state=True, mailbox=""):
+    """Queue the messages with attachments that arrived in folder since the last run; returns the number queued.
+
+    With use_sync_state the EWS sync state, stored in the queue under key, marks
+    what was seen: only new items are transferred, including ones that arrived
+    while the previous run was going. The state is saved after the messages, so an
+    interrupted sync is repeated (the queue ignores known messages). Without a
+    usable state (first run, or expired) and without use_sync_state, the server is
+    asked for everything received after start_date. The jobs are queued under
+    mailbox.
+    """
+    if not use_sync_state:
+        return queue.add(attachment_messages(folder, start_date), mailbox=mailbox)
+    sync_state = queue.sync_state(key)
+    if sync_state is not None:
+        try:
+            added = queue.add(changed_messages(folder, sync_state), mailbox=mailbox)
+            queue.save_sync_state(key, folder.item_sync_state)
+            return added
+        except ErrorInvalidSyncStateData:
+            pass  # Expired or from another folder: start over from start_date
+    # State first: whatever arrives after it is left for the next sync, whatever
+    # arrived before it and after start_date is in the listing
+    sync_state = current_sync_state(folder)
+    added = queue.add(attachment_messages(folder, start_date), mailbox=mailbox)
+    queue.save_sync_state(key, sync_state)
+    return added
+
+
+def fetch_messages(account, ids, chunk_size=CHUNK_SIZE):
+    """Subject and attachment list of each (id, changekey); an exception stands in
+    for a message that could not be fetched (e.g. deleted since it was queued)."""
+    return account.fetch(ids=ids, folder=account.inbox, only_fields=ATTACHMENT_FIELDS, chunk_size=chunk_size)
+
+
+def probe_session(account):
+    """Cheapest request that needs a working session: GetFolder for the inbox, ID only."""
+    for folder in GetFolder(account=account).call(folders=[account.inbox], additional_fields=None, shape=ID_ONLY):
+        if isinstance(folder, Exception):
+            raise folder
+
+
+class Session:
+    """The logged-in account, checked with as little traffic as possible.
+
+    A successful login or probe is trusted for `ttl` seconds. A session that
+    would get older than `lifetime` before the next keep-alive is replaced by a
+    fresh login from connect(), so it is renewed in the background instead of
+    failing in the middle of a run. Used from one thread at a time.
+    """
+
+    def __init__(self, connect, ttl=SESSION_TTL, lifetime=SESSION_LIFETIME, keepalive=SESSION_KEEPALIVE):
+        self.connect = connect  # Logs in and returns a new Account
+        self.ttl = ttl
+        self.lifetime = lifetime
+        self.keepalive = keepalive
+        self.account = None
+        self.logged_in_at = None
+        self.checked_at = None
+
+    @classmethod
+    def from_config(cls, config, connect):
+        return cls(connect, float(config.get("session_ttl_seconds", SESSION_TTL)),
+                   float(config.get("session_lifetime_seconds", SESSION_LIFETIME)),
+                   float(config.get("session_keepalive_seconds", SESSION_KEEPALIVE)))
+
+    def attach(self, account):
+        """Use an account that has just logged in."""
+        self.account = account
+        self.logged_in_at = self.checked_at = time.monotonic()
+
+    def invalidate(self):
+        """Probe again before the next use, e.g. after a request failed."""
+        self.checked_at = None
+
+    def expires_soon(self):
+        return time.monotonic() - self.logged_in_at + self.keepalive >= self.lifetime
+
+    def is_valid(self):
+        if self.account is None:
+            return False
+        if self.checked_at is not None and time.monotonic() - self.checked_at < self.ttl:
+            return True
+        try:
+            probe_session(self.account)
+        except Exception:  # Expired, password changed, server unreachable: log in again
+            self.invalidate()
+            return False
+        self.checked_at = time.monotonic()
+        return True
+
+    def ensure(self):
+        """The account, logged in again first if the session stopped working or expires soon."""
+        if self.account is None or self.expires_soon() or not self.is_valid():
+            self.attach(self.connect())
+        return self.account
+
+
+class JobQueue:
+    """Persistent queue of the messages to process, kept in SQLite so an
+    interrupted run resumes where it stopped.
+
+    A message goes pending -> downloaded -> uploaded, or to failed; failed
+    messages run again on later runs until they failed MAX_ATTEMPTS times.
+    Saved attachment files are tracked with the messages they came from (one
+    content-addressed file can serve several), and a message counts as
+    uploaded once all of its files are. Jobs from several mailboxes share the
+    queue; each job records the mailbox it is fetched from.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            message_id TEXT PRIMARY KEY,
+            changekey TEXT,
+            received TEXT,
+            subject TEXT,
+            state TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            updated REAL,
+            mailbox TEXT NOT NULL DEFAULT ''
+        );
+        CREATE INDEX IF NOT EXISTS jobs_mailbox ON jobs (mailbox, state);
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT NOT NULL,
+            message_id TEXT NOT NULL,
+            state TEXT NOT NULL,
+            error TEXT,
+            PRIMARY KEY (path, message_id)
+        );
+        CREATE INDEX IF NOT EXISTS files_message ON files (message_id);
+        CREATE TABLE IF NOT EXISTS sync (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            updated REAL
+        );
+    """
+    RUNNABLE = "(state = 'pending' OR (state = 'failed' AND attempts < ?))"
+
+    def __init__(self, path=QUEUE_PATH):
+        # One connection per thread; WAL lets the download and upload threads share the file
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        # Version 0 keyed files by path alone
+        old_files = (self.db.execute("PRAGMA user_version").fetchone()[0] < 1 and
+                     self.db.execute("SELECT 1 FROM sqlite_master WHERE name = 'files'").fetchone())
+        if old_files:
+            self.db.execute("ALTER TABLE files RENAME TO files_v0")
+        # Before version 2 jobs had no mailbox; see adopt()
+        job_columns = [row[1] for row in self.db.execute("PRAGMA table_info(jobs)")]
+        if job_columns and "mailbox" not in job_columns:
+            self.db.execute("ALTER TABLE jobs ADD COLUMN mailbox TEXT NOT NULL DEFAULT ''")
+        self.db.executescript(self.SCHEMA)
+        if old_files:
+            self.db.executescript("INSERT INTO files SELECT path, message_id, state, error FROM files_v0; "
+                                  "DROP TABLE files_v0;")
+        self.db.execute("PRAGMA user_version = 2")
+
+    def close(self):
+        self.db.close()
+
+    def add(self, messages, batch=500, mailbox=""):
+        """Queue messages from a listing of mailbox, committing every `batch`; known
+        messages keep their state. Returns the number of new jobs."""
+        added = 0
+        rows = ((m.id, m.changekey, str(m.datetime_received), m.subject, time.time(), mailbox) for m in messages)
+        while True:
+            chunk = list(itertools.islice(rows, batch))
+            if not chunk:
+                return added
+            with self.db:
+                before = self.db.total_changes
+                self.db.executemany(
+                    "INSERT OR IGNORE INTO jobs (message_id, changekey, received, subject, updated, mailbox) "
+                    "VALUES (?, ?, ?, ?, ?, ?)", chunk)
+                added += self.db.total_changes - before
+
+    def _runnable(self, mailbox):
+        """WHERE clause and parameters for the runnable jobs, of one mailbox unless it is None."""
+        if mailbox is None:
+            return self.RUNNABLE, (MAX_ATTEMPTS,)
+        return f"{self.RUNNABLE} AND mailbox = ?", (MAX_ATTEMPTS, mailbox)
+
+    def runnable_count(self, mailbox=None):
+        where, params = self._runnable(mailbox)
+        return self.db.execute(f"SELECT COUNT(*) FROM jobs WHERE {where}", params).fetchone()[0]
+
+    def runnable(self, batch=CHUNK_SIZE, mailbox=None):
+        """Batches of (message_id, changekey) to download, in the order they were queued.
+
+        Walks forward by rowid, so updating rows while iterating is safe and
+        each batch is an index range scan.
+        """
+        where, params = self._runnable(mailbox)
+        last = 0
+        while True:
+            rows = self.db.execute(
+                f"SELECT rowid, message_id, changekey FROM jobs WHERE {where} AND rowid > ? "
+                "ORDER BY rowid LIMIT ?", (*params, last, batch)).fetchall()
+            if not rows:
+                return
+            last = rows[-1][0]
+            yield [(message_id, changekey) for _, message_id, changekey in rows]
+
+    def mark(self, message_id, state, error=None):
+        with self.db:
+            self.db.execute(
+                "UPDATE jobs SET state = ?, error = ?, attempts = attempts + ?, updated = ? WHERE message_id = ?",
+                (state, error, state == "failed", time.time(), message_id))
+
+    def add_file(self, path, message_id):
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO files (path, message_id, state) VALUES (?, ?, 'downloaded')",
+                            (path, message_id))
+
+    def file_uploaded(self, path, error=None):
+        """Record the upload of a saved file; an error fails its messages so they are fetched again."""
+        message_ids = [row[0] for row in self.db.execute("SELECT message_id FROM files WHERE path = ?", (path,))]
+        with self.db:
+            if error:
+                self.db.execute("UPDATE files SET state = 'failed', error = ? WHERE path = ?", (error, path))
+                self.db.executemany(
+                    "UPDATE jobs SET state = 'failed', error = ?, attempts = attempts + 1, updated = ? "
+                    "WHERE message_id = ?", [(error, time.time(), message_id) for message_id in message_ids])
+                return
+            self.db.execute("UPDATE files SET state = 'uploaded' WHERE path = ?", (path,))
+            self.db.executemany(
+                "UPDATE jobs SET state = 'uploaded', updated = ? WHERE message_id = ? AND state = 'downloaded' "
+                "AND NOT EXISTS (SELECT 1 FROM files WHERE message_id = ? AND state != 'uploaded')",
+                [(time.time(), message_id, message_id) for message_id in message_ids])
+
+    def unuploaded_files(self):
+        """Saved files not uploaded yet, e.g. because the run that saved them ended first."""
+        return [row[0] for row in self.db.execute("SELECT DISTINCT path FROM files WHERE state = 'downloaded'")]
+
+    def refetch(self, path):
+        """A saved file is gone before its upload: its messages are downloaded again."""
+        with self.db:
+            self.db.execute(
+                "UPDATE jobs SET state = 'pending', updated = ? WHERE state = 'downloaded' "
+                "AND message_id IN (SELECT message_id FROM files WHERE path = ?)", (time.time(), path))
+            self.db.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def sync_state(self, key):
+        row = self.db.execute("SELECT state FROM sync WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def save_sync_state(self, key, state):
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO sync VALUES (?, ?, ?)", (key, state, time.time()))
+
+    def adopt(self, mailbox):
+        """Give the jobs queued before mailboxes were recorded to mailbox (the app's own)."""
+        with self.db:
+            self.db.execute("UPDATE jobs SET mailbox = ? WHERE mailbox = ''", (mailbox,))
+
+    def counts(self):
+        return dict(self.db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"))
+
+    def prune(self, days=PRUNE_DAYS):
+        with self.db:
+            self.db.execute("DELETE FROM jobs WHERE state = 'uploaded' AND updated < ?",
+                            (time.time() - days * 86400,))
+            self.db.execute("DELETE FROM files WHERE message_id NOT IN (SELECT message_id FROM jobs)")
+
+
+def is_wanted(attachment):
+    return isinstance(attachment, FileAttachment) and attachment.name.lower().endswith(ATTACHMENT_EXTENSIONS)
+
+
+def save_attachment(attachment, folder):
+    """Stream a FileAttachment into folder without holding the body in memory;
+    returns the saved path, named after the content's SHA-256 (see content_name).
+
+    The body goes to a temporary .part file first, so a failed download never
+    leaves a truncated file where the uploader would pick it up. Content that
+    is already in the folder is not written twice.
+    """
+    fd, part = tempfile.mkstemp(suffix=".part", dir=folder)
+    try:
+        digest = hashlib.sha256()
+        with os.fdopen(fd, "wb") as out, attachment.fp as fp:
+            for chunk in iter(lambda: fp.read(COPY_BUFFER), b""):
+                digest.update(chunk)
+                out.write(chunk)
+        file_path = os.path.join(folder, content_name(attachment.name, digest.hexdigest()))
+        if os.path.exists(file_path):
+            os.remove(part)
+        else:
+            os.replace(part, file_path)
+        return file_path
+    except BaseException:
+        if os.path.exists(part):
+            os.remove(part)
+        raise
+
+
+class AttachmentDownloader:
+    """Saves the matching attachments of queued messages with a pool of threads.
+
+    At most two messages per worker are in flight. Queue bookkeeping happens on
+    the thread that runs run(), which also calls on_progress(processed_emails,
+    attachments_found, attachments_saved), on_error(message) and, once a
+    message's files are recorded in the queue, on_saved(path) for each file.
+    """
+
+    def __init__(self, destination_folder, workers=DOWNLOAD_WORKERS, rate=DOWNLOAD_RATE,
+                 on_progress=None, on_error=None, on_saved=None):
+        self.destination_folder = destination_folder
+        self.workers = max(1, workers)
+        self.limiter = RateLimiter(rate)
+        self.on_progress = on_progress
+        self.on_error = on_error
+        self.on_saved = on_saved
+        self.processed_emails = 0
+        self.attachments_found = 0
+        self.attachments_saved = 0
+        self.failed = 0
+        self._is_running = True
+
+    def stop(self):
+        self._is_running = False
+
+    def _should_stop(self):
+        return not self._is_running
+
+    def run(self, queue, fetch, mailbox=None):
+        """Download the queue's runnable messages (of mailbox, if given); fetch(ids) returns
+        the messages for a batch of (id, changekey), in order. Returns False if stopped
+        before the end."""
+        pending = set()
+        with ThreadPoolExecutor(self.workers) as pool:
+            for batch in queue.runnable(mailbox=mailbox):
+                for (message_id, _), message in zip(batch, fetch(batch)):
+                    if not self._is_running:
+                        break
+                    if isinstance(message, Exception):
+                        self._collect(queue, [(message_id, 0, [], [f"{message_id}: {message}"])])
+                        continue
+                    if len(pending) >= 2 * self.workers:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        self._collect(queue, [future.result() for future in done])
+                    pending.add(pool.submit(self._save_message, message_id, message))
+                if not self._is_running:
+                    break
+            self._collect(queue, [future.result() for future in pending])
+        return self._is_running
+
+    def _collect(self, queue, results):
+        for result in results:
+            if result is None:
+                continue  # Stopped midway; stays pending for the next run
+            message_id, found, saved, errors = result
+            self.processed_emails += 1
+            self.attachments_found += found
+            self.attachments_saved += len(saved)
+            self.failed += len(errors)
+            for path in saved:
+                queue.add_file(path, message_id)
+            if errors:
+                queue.mark(message_id, "failed", "; ".join(errors))
+            else:
+                # Nothing worth uploading counts as done
+                queue.mark(message_id, "downloaded" if saved else "uploaded")
+            for error in errors:
+                if self.on_error:
+                    self.on_error(error)
+            if self.on_saved:
+                for path in saved:
+                    self.on_saved(path)
+        if self.on_progress:
+            self.on_progress(self.processed_emails, self.attachments_found, self.attachments_saved)
+
+    def _save_message(self, message_id, message):
+        found = 0
+        saved = []
+        errors = []
+        for attachment in message.attachments or []:
+            found += 1
+            if not is_wanted(attachment):
+                continue
+            if not self.limiter.acquire(self._should_stop):
+                return None
+            try:
+                saved.append(save_attachment(attachment, self.destination_folder))
+            except Exception as e:
+                errors.append(f"{attachment.name} ({message.subject}): {e}")
+        return message_id, found, saved, errors
+
+
+class Pipeline:
+    """Downloads and uploads at the same time: every saved file goes to the
+    uploader through a bounded queue as soon as its message is recorded, and
+    the downloaders wait (backpressure) while PIPELINE_DEPTH files are queued.
+    Several downloaders (one per mailbox) can feed the same uploader.
+
+    The upload stage runs in its own thread with its own queue connection.
+    Files saved by an earlier run that ended before uploading them go first.
+    Pipeline takes over uploader.on_result; on_uploaded(path, error, saved) is
+    called from the upload thread instead, saved being the number of attachments
+    of this run the file stands for (one content file can serve several, and
+    files left by an earlier run stand for none).
+    """
+
+    def __init__(self, uploader, queue_path=QUEUE_PATH, depth=PIPELINE_DEPTH, on_uploaded=None):
+        self.uploader = uploader
+        self.queue_path = queue_path
+        self.saved = Queue(depth)
+        self.on_uploaded = on_uploaded
+        self.handed = Counter()  # Path -> attachments saved to it and not reported yet
+        self.lock = threading.Lock()
+        self.downloaders = []
+        self.results = {}
+        self.upload_error = None
+
+    def add(self, downloader):
+        """Send downloader's saved files to the uploader; returns the downloader."""
+        downloader.on_saved = self._hand_over
+        self.downloaders.append(downloader)
+        return downloader
+
+    def _hand_over(self, path):
+        with self.lock:
+            self.handed[path] += 1
+        self.saved.put(path)
+
+    def stop(self):
+        for downloader in self.downloaders:
+            downloader.stop()
+        self.uploader.stop()
+
+    def _upload(self):
+        paths = iter_queue(self.saved)
+        try:
+            files = JobQueue(self.queue_path)
+            try:
+                def on_result(path, error):
+                    if error == STOPPED:
+                        return  # Not attempted: stays 'downloaded' and goes up with the next run
+                    # A failed upload sends the message back to the queue for the next run
+                    files.file_uploaded(path, error)
+                    with self.lock:
+                        saved = self.handed.pop(path, 0)
+                    if self.on_uploaded:
+                        self.on_uploaded(path, error, saved)
+
+                self.uploader.on_result = on_result
+                self.results = self.uploader.run(paths)
+            finally:
+                files.close()
+        except Exception as e:
+            self.upload_error = str(e)
+            for _ in paths:  # Keep the downloaders from blocking on a full queue
+                pass
+
+    def _queue_leftovers(self):
+        files = JobQueue(self.queue_path)
+        try:
+            for path in files.unuploaded_files():
+                if os.path.exists(path):
+                    self.saved.put(path)
+                else:
+                    files.refetch(path)
+        finally:
+            files.close()
+
+    def run(self, *downloads):
+        """Call each download function on a thread of its own (one that runs an added
+        downloader) while uploading what they save; returns their results, in order,
+        once both stages are done."""
+        upload_thread = threading.Thread(target=self._upload, name="upload", daemon=True)
+        upload_thread.start()
+        try:
+            self._queue_leftovers()  # Before the downloads, so refetched messages are runnable again
+            with ThreadPoolExecutor(max(1, len(downloads)), thread_name_prefix="download") as pool:
+                futures = [pool.submit(download) for download in downloads]
+            return [future.result() for future in futures]
+        finally:
+            self.saved.put(None)
+            upload_thread.join()
+
+
+class MailboxSource:
+    """One mailbox to aggregate: its SMTP address, the Session that logs in for it
+    and its own download limits. The last run's total and error are kept here."""
+
+    def __init__(self, address, session, workers=DOWNLOAD_WORKERS, rate=DOWNLOAD_RATE):
+        self.address = address
+        self.session = session
+        self.workers = workers
+        self.rate = rate
+        self.total = 0
+        self.downloader = None
+        self.error = None
+
+    @property
+    def sync_key(self):
+        return f"{self.address}/inbox"
+
+
+class MailboxEngine:
+    """Processes the inboxes of several mailboxes at once into one upload pipeline.
+
+    Every mailbox runs on its own thread with its own queue connection, session
+    and AttachmentDownloader, so workers and rate limits are per mailbox and
+    the EWS connections per login (MAX_CONNECTIONS). Sync state and jobs are
+    kept per mailbox; one that fails does not stop the others. Callbacks come
+    from the mailbox threads: on_total(address, total), on_progress(address,
+    processed_emails, attachments_found, attachments_saved), on_error(address,
+    message) for an attachment and on_done(address, error) when a mailbox is
+    finished (error is None if it went through).
+    """
+
+    def __init__(self, sources, uploader, destination_folder, queue_path=QUEUE_PATH, depth=PIPELINE_DEPTH,
+                 on_total=None, on_progress=None, on_error=None, on_done=None, on_uploaded=None):
+        self.sources = list(sources)
+        self.destination_folder = destination_folder
+        self.queue_path = queue_path
+        self.pipeline = Pipeline(uploader, queue_path, depth, on_uploaded)
+        self.on_total = on_total
+        self.on_progress = on_progress
+        self.on_error = on_error
+        self.on_done = on_done
+        self._is_running = True
+
+    @property
+    def upload_error(self):
+        return self.pipeline.upload_error
+
+    def stop(self):
+        self._is_running = False
+        self.pipeline.stop()
+
+    def run(self, start_date, use_sync_state=True):
+        """Queue and download each mailbox's new messages while uploading; returns the
+        number of mailboxes that failed."""
+        for source in self.sources:
+            source.total, source.downloader, source.error = 0, None, None
+        self.pipeline.run(*(partial(self._process, source, start_date, use_sync_state) for source in self.sources))
+        return sum(source.error is not None for source in self.sources)
+
+    def _process(self, source, start_date, use_sync_state):
+        address = source.address
+        queue = JobQueue(self.queue_path)
+        try:
+            account = source.session.ensure()
+            queue_new_messages(queue, account.inbox, source.sync_key, start_date, use_sync_state, address)
+            source.total = queue.runnable_count(address)
+            if self.on_total:
+                self.on_total(address, source.total)
+            source.downloader = self.pipeline.add(AttachmentDownloader(
+                self.destination_folder, source.workers, source.rate,
+                on_progress=self.on_progress and partial(self.on_progress, address),
+                on_error=self.on_error and partial(self.on_error, address)))
+            if not self._is_running:
+                source.downloader.stop()
+            source.downloader.run(queue, lambda ids: fetch_messages(account, ids), address)
+        except Exception as e:
+            source.error = str(e)
+            source.session.invalidate()
+        finally:
+            queue.close()
+        if self.on_done:
+            self.on_done(address, source.error)
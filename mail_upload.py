@@ -0,0 +1,397 @@
+"""Upload side of the mail attachment aggregators (mail_gui_v5.py, mail_gui_v6.py).
+
+One pooled requests.Session, a bounded number of uploads in flight, a token
+bucket on request starts and retries with exponential backoff. No Qt and no
+mail client imports, so both apps share it and it runs against a local
+stand-in of the upload endpoint (point "upload_url" in config.json at it).
+"""
+import io
+import os
+import re
+import gzip
+import time
+import uuid
+import random
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+import threading
+import queue
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import zstandard  # Optional: enables "zstd" upload compression
+except ImportError:
+    zstandard = None
+
+DEFAULT_UPLOAD_URL = "https://bi.mci.ir/myflask/upload"
+UPLOAD_WORKERS = 4
+UPLOAD_RATE = 0  # Upload requests started per second; 0 means no limit
+UPLOAD_RETRIES = 4
+BACKOFF_SECONDS = 1.0  # First retry delay, doubled on every further attempt
+MAX_BACKOFF_SECONDS = 60
+UPLOAD_TIMEOUT = (10, 300)  # Connect, read seconds
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+# Compression is off unless configured: the receiver has to honour the part's
+# Content-Encoding. .xlsx is a zip already and is always sent as is.
+COMPRESSIBLE = ('.csv', '.xls', '.txt', '.json', '.xml')
+SPOOL_BYTES = 4 * 1024 * 1024  # Compressed copies larger than this go to a temporary file
+COPY_BUFFER = 256 * 1024
+# Files smaller than BATCH_BYTES are posted together, up to BATCH_BYTES and BATCH_FILES
+# per request, as repeated "file" parts. 0 sends one file per request.
+BATCH_BYTES = 0
+BATCH_FILES = 50
+SENT_INDEX_PATH = "sent_uploads.sqlite3"
+# Saved attachments are named "<first DIGEST_CHARS of the SHA-256>_<attachment name>":
+# equal content lands in one file and different content never overwrites.
+DIGEST_CHARS = 16
+CONTENT_NAME = re.compile(r"^[0-9a-f]{%d}_(.+)$" % DIGEST_CHARS)
+IDLE = object()  # Yielded by iter_queue when no path arrived for a while
+PIPELINE_DEPTH = 32  # Saved files waiting for upload; the saving side pauses while this many are queued
+STOPPED = "stopped"  # Result of an upload cut short by stop(); not an attempt, the file is still to go up
+
+
+def upload_url(config):
+    return config.get("upload_url") or DEFAULT_UPLOAD_URL
+
+
+class RateLimiter:
+    """Token bucket shared by worker threads: `rate` acquisitions per second on
+    average, with bursts of up to `burst`. A rate of 0 disables the limit."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, should_stop=None):
+        """Wait for a token; returns False if should_stop() turned true first."""
+        if not self.rate:
+            return True
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                delay = (1 - self.tokens) / self.rate
+            if should_stop is not None and should_stop():
+                return False
+            time.sleep(min(delay, 0.5))
+
+
+def content_name(name, digest):
+    return f"{digest[:DIGEST_CHARS]}_{os.path.basename(name)}"
+
+
+def upload_name(path):
+    """Name a saved file is uploaded under: the attachment name, without the digest prefix."""
+    filename = os.path.basename(path)
+    match = CONTENT_NAME.match(filename)
+    return match.group(1) if match else filename
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(COPY_BUFFER), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SentIndex:
+    """SHA-256 digests of the content already uploaded, kept in SQLite, so a
+    file attached to several emails, or sent again the next day, goes up once."""
+
+    def __init__(self, path=SENT_INDEX_PATH):
+        # May be opened on one thread and used by the uploader on another, never by both at once
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS sent (digest TEXT PRIMARY KEY, name TEXT, "
+                        "size INTEGER, uploaded REAL)")
+
+    def close(self):
+        self.db.close()
+
+    def __contains__(self, digest):
+        return self.db.execute("SELECT 1 FROM sent WHERE digest = ?", (digest,)).fetchone() is not None
+
+    def add(self, digest, name, size):
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO sent VALUES (?, ?, ?, ?)", (digest, name, size, time.time()))
+
+
+def compress(src, dst, encoding):
+    if encoding == "zstd":
+        zstandard.ZstdCompressor().copy_stream(src, dst, read_size=COPY_BUFFER, write_size=COPY_BUFFER)
+    else:
+        with gzip.GzipFile(fileobj=dst, mode="wb", compresslevel=6) as out:
+            shutil.copyfileobj(src, out, COPY_BUFFER)
+
+
+class MultipartBody:
+    """multipart/form-data body read from the files piece by piece.
+
+    requests sends a file-like body with a known length as is, so the upload
+    streams with a Content-Length instead of building the request in memory.
+    parts: [(filename, fileobj, size, content_encoding or None)].
+    """
+
+    def __init__(self, parts):
+        boundary = uuid.uuid4().hex
+        self.content_type = f"multipart/form-data; boundary={boundary}"
+        self.segments = []
+        self.length = 0
+        for filename, fileobj, size, encoding in parts:
+            quoted = filename.replace('"', "%22")
+            head = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{quoted}"\r\n'
+                    f'Content-Type: application/octet-stream\r\n')
+            if encoding:
+                head += f"Content-Encoding: {encoding}\r\n"
+            head = (head + "\r\n").encode("utf-8")
+            self.segments += [io.BytesIO(head), fileobj, io.BytesIO(b"\r\n")]
+            self.length += len(head) + size + 2
+        tail = f"--{boundary}--\r\n".encode()
+        self.segments.append(io.BytesIO(tail))
+        self.length += len(tail)
+
+    def __len__(self):
+        return self.length
+
+    def read(self, size=-1):
+        chunks = []
+        while self.segments and size != 0:
+            chunk = self.segments[0].read(COPY_BUFFER if size < 0 else size)
+            if not chunk:
+                self.segments.pop(0)
+                continue
+            chunks.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b"".join(chunks)
+
+
+def iter_queue(paths_queue, poll=0.5):
+    """Paths put on a queue.Queue by another thread, until it puts None. Yields
+    IDLE after `poll` seconds without a path so the consumer can catch up."""
+    while True:
+        try:
+            path = paths_queue.get(timeout=poll)
+        except queue.Empty:
+            yield IDLE
+            continue
+        if path is None:
+            return
+        yield path
+
+
+def batches(paths, batch_bytes=BATCH_BYTES, batch_files=BATCH_FILES):
+    """Group paths into upload requests: small files together, anything else alone.
+    An IDLE in paths sends the small files collected so far."""
+    batch, batch_size = [], 0
+    for path in paths:
+        if path is IDLE:
+            if batch:
+                yield batch
+                batch, batch_size = [], 0
+            yield IDLE
+            continue
+        size = os.path.getsize(path) if batch_bytes else 0
+        if not batch_bytes or size >= batch_bytes:
+            yield [path]
+            continue
+        if batch and (batch_size + size > batch_bytes or len(batch) >= batch_files):
+            yield batch
+            batch, batch_size = [], 0
+        batch.append(path)
+        batch_size += size
+    if batch:
+        yield batch
+
+
+def retry_delay(attempt, response=None, backoff=BACKOFF_SECONDS):
+    """Seconds to wait before retry number attempt + 1: the server's Retry-After
+    if it sent one, otherwise exponential backoff with jitter."""
+    if response is not None:
+        try:
+            return min(float(response.headers["Retry-After"]), MAX_BACKOFF_SECONDS)
+        except (KeyError, ValueError):
+            pass
+    return min(MAX_BACKOFF_SECONDS, backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+
+
+class Uploader:
+    """Posts files to the upload endpoint, `workers` requests at a time over one
+    connection pool. on_result(path, error) is called from the thread that
+    runs run(), once per file; error is None when the upload succeeded and
+    STOPPED when stop() came first.
+
+    compression ("gzip" or "zstd") compresses COMPRESSIBLE files and marks
+    their part with Content-Encoding; batch_bytes > 0 posts small files
+    together. Both need support on the receiving end and are off by default.
+
+    With a SentIndex, content is uploaded once: files whose digest was sent
+    before, or that repeat another file of the same run, are skipped and
+    reported with the outcome of the upload that carried their content.
+    """
+
+    def __init__(self, url=DEFAULT_UPLOAD_URL, workers=UPLOAD_WORKERS, rate=UPLOAD_RATE,
+                 retries=UPLOAD_RETRIES, backoff=BACKOFF_SECONDS, verify=False, on_result=None,
+                 compression=None, batch_bytes=BATCH_BYTES, sent=None):
+        self.url = url
+        self.workers = max(1, workers)
+        self.limiter = RateLimiter(rate)
+        self.retries = retries
+        self.backoff = backoff
+        self.on_result = on_result
+        if compression == "zstd" and zstandard is None:
+            print("zstandard is not installed; compressing uploads with gzip")
+            compression = "gzip"
+        self.compression = compression
+        self.batch_bytes = batch_bytes
+        self.sent = sent
+        self.skipped = 0
+        self.session = requests.Session()
+        self.session.verify = verify
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._stopped = threading.Event()
+
+    def stop(self):
+        self._stopped.set()
+
+    def close(self):
+        self.session.close()
+
+    def _part(self, path, stack):
+        """(filename, fileobj, size, content_encoding) for one file of a request."""
+        name = upload_name(path)
+        f = stack.enter_context(open(path, "rb"))
+        size = os.fstat(f.fileno()).st_size
+        if self.compression and name.lower().endswith(COMPRESSIBLE):
+            spool = stack.enter_context(tempfile.SpooledTemporaryFile(SPOOL_BYTES))
+            compress(f, spool, self.compression)
+            if spool.tell() < size:  # Send it raw when compression does not help
+                return name, spool, spool.tell(), self.compression
+        return name, f, size, None
+
+    def upload(self, paths):
+        """Upload one file, or several in one request, retrying connection errors,
+        timeouts, 429 and 5xx. Returns None on success, otherwise the last error."""
+        if isinstance(paths, str):
+            paths = [paths]
+        with ExitStack() as stack:
+            parts = [self._part(path, stack) for path in paths]
+            return self._post(parts)
+
+    def _post(self, parts):
+        error = None
+        for attempt in range(self.retries + 1):
+            if self._stopped.is_set() or not self.limiter.acquire(self._stopped.is_set):
+                return STOPPED
+            response = None
+            for _, fileobj, _, _ in parts:
+                fileobj.seek(0)
+            body = MultipartBody(parts)
+            try:
+                response = self.session.post(self.url, data=body, headers={"Content-Type": body.content_type},
+                                             timeout=UPLOAD_TIMEOUT)
+                if response.status_code == 200:
+                    return None
+                error = f"HTTP {response.status_code}: {response.text[:200]}"
+                if response.status_code not in RETRY_STATUS:
+                    return error
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = str(e)
+            if attempt < self.retries and self._stopped.wait(retry_delay(attempt, response, self.backoff)):
+                return STOPPED
+        return error
+
+    def _report(self, results, paths, error):
+        for path in paths:
+            results[path] = error
+            if self.on_result:
+                self.on_result(path, error)
+
+    def _unique(self, paths, results, copies, digest_of):
+        """Paths whose content still has to go up; the others are reported or
+        wait for the upload of the same content."""
+        uploading = {}  # Digest -> path carrying it
+        for path in paths:
+            if path is IDLE:
+                yield path
+                continue
+            # One file can serve several messages and be handed over once for each
+            if path in copies:
+                continue  # Reported with the upload on its way
+            if path in results:
+                self._report(results, [path], results[path])
+                continue
+            if self.sent is not None:
+                try:
+                    digest = file_digest(path)
+                except OSError as e:
+                    self._report(results, [path], str(e))
+                    continue
+                if digest in self.sent:
+                    self.skipped += 1
+                    self._report(results, [path], None)
+                    continue
+                first = uploading.get(digest)
+                if first in copies:
+                    self.skipped += 1
+                    copies[first].append(path)
+                    continue
+                uploading[digest] = path
+                digest_of[path] = digest
+            copies[path] = [path]
+            yield path
+
+    def run(self, paths):
+        """Upload every path; returns {path: error or None}.
+
+        paths may be a list or iter_queue() over a queue another thread fills:
+        uploads start as paths arrive, at most two requests per worker are
+        queued, and results are reported as they come in.
+        """
+        results = {}
+        copies = {}  # Path being uploaded -> every path with the same content
+        digest_of = {}
+        pending = {}
+
+        def collect(block):
+            if not pending:
+                return
+            done, _ = wait(pending, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    error = future.result()
+                except Exception as e:  # Unreadable file and the like
+                    error = str(e)
+                for path in pending.pop(future):
+                    digest = digest_of.pop(path, None)
+                    if digest is not None and error is None:
+                        self.sent.add(digest, upload_name(path), os.path.getsize(path))
+                    self._report(results, copies.pop(path), error)
+
+        with ThreadPoolExecutor(self.workers) as pool:
+            unique = self._unique(paths, results, copies, digest_of)
+            for batch in batches(unique, self.batch_bytes):
+                if batch is IDLE:
+                    collect(block=False)
+                    continue
+                while len(pending) >= 2 * self.workers:
+                    collect(block=True)
+                pending[pool.submit(self.upload, batch)] = batch
+            while pending:
+                collect(block=True)
+        return results
@@ -0,0 +1,1020 @@
+"""Qt-free core of the Excel/CSV metadata scanner.
+
+Used by the desktop app (gui_scan_data_file.py) and the headless command line
+and daemon entry point (scan_cli.py).
+"""
+import os
+import csv
+import json
+import codecs
+import fnmatch
+import hashlib
+import time
+import queue
+import logging
+import itertools
+import importlib.util
+import multiprocessing
+from collections import deque, Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor, ALL_COMPLETED, FIRST_COMPLETED, wait
+import numpy as np
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+
+try:
+    import psutil  # Optional: enables the per-file memory budget
+except ImportError:
+    psutil = None
+
+try:
+    import xxhash  # Optional: faster content hashing for duplicate detection
+except ImportError:
+    xxhash = None
+
+log = logging.getLogger("metadata_scanner")
+
+DEFAULT_INCLUDE = ("*.xlsx", "*.xlsm", "*.xls", "*.xlsb", "*.ods", "*.csv")
+CHECKPOINT_EVERY_FILES = 200  # Flush the checkpoint after this many files...
+CHECKPOINT_EVERY_SECONDS = 30  # ...or after this much time, whichever comes first
+
+
+class ScanCheckpoint:
+    """Append-only journal of a scan so it can resume after being interrupted.
+
+    The first line holds the scan roots and options, the report path and the
+    enumerated file list (the pending queue); every following line holds one
+    completed file, the report rows it produced and, for duplicate detection,
+    its content hash.
+    """
+
+    def __init__(self, roots, output_path, profile=False, include=None):
+        self.roots = sorted(os.path.abspath(root) for root in roots)
+        self.output_path = os.path.abspath(output_path)
+        self.profile = profile
+        self.include = sorted(include or DEFAULT_INCLUDE)
+        self.path = self.output_path + ".checkpoint.jsonl"
+        self.file_list = []
+        self.completed = set()
+        self._buffer = []
+        self._last_flush = time.time()
+
+    def load(self):
+        """Load a checkpoint left by an earlier run on the same roots and output."""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                header = json.loads(f.readline())
+                if (header.get("roots") != self.roots
+                        or header.get("output_path") != self.output_path
+                        or header.get("profile", False) != self.profile
+                        or header.get("include") != self.include):
+                    return False
+                self.file_list = [tuple(item) for item in header["files"]]
+                for entry in self._entries(f):
+                    self.completed.add(entry["path"])
+        except (OSError, ValueError, KeyError):
+            return False
+        return True
+
+    def replay(self):
+        """Yield the journal entry of every file completed by the earlier run."""
+        with open(self.path, "r", encoding="utf-8") as f:
+            f.readline()
+            yield from self._entries(f)
+
+    @staticmethod
+    def _entries(f):
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break  # Torn write from a crash; everything before it is valid
+            entry.setdefault("reason", None)
+            entry.setdefault("digest", None)
+            entry.setdefault("duplicate_of", None)
+            entry.setdefault("transient", False)
+            yield entry
+
+    def start(self, file_list):
+        self.file_list = file_list
+        self.completed = set()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({
+                "roots": self.roots,
+                "output_path": self.output_path,
+                "profile": self.profile,
+                "include": self.include,
+                "files": file_list,
+            }, f)
+            f.write("\n")
+
+    def record(self, file_path, rows, reason=None, digest=None, duplicate_of=None, transient=False):
+        self.completed.add(file_path)
+        entry = {"path": file_path, "rows": rows}
+        if reason:
+            entry["reason"] = reason
+        if digest:
+            entry["digest"] = digest
+        if duplicate_of:
+            entry["duplicate_of"] = duplicate_of
+        if transient:
+            entry["transient"] = True
+        self._buffer.append(json.dumps(entry, default=str))
+        if (len(self._buffer) >= CHECKPOINT_EVERY_FILES
+                or time.time() - self._last_flush >= CHECKPOINT_EVERY_SECONDS):
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("\n".join(self._buffer) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self._buffer = []
+        self._last_flush = time.time()
+
+    def discard(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def file_digest(file_path):
+    """Content hash used to detect copies of the same file (xxh3 if available, else BLAKE2b)."""
+    digest = xxhash.xxh3_128() if xxhash is not None else hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+FILE_TIMEOUT_SECONDS = 120  # Hard limit for parsing a single file
+PROFILE_TIMEOUT_SECONDS = 1800  # Profiling reads whole files, so allow more time
+FILE_MEMORY_LIMIT_MB = 2048  # Parser process RSS limit (needs psutil)
+PARSER_POLL_SECONDS = 0.5
+# Parse failures that may not recur (load, budget, a one-off crash); these files
+# are parsed again on the next run instead of reusing the manifest entry
+TRANSIENT_STATUSES = {"timeout", "memory", "crashed"}
+
+
+CSV_SNIFF_BYTES = 64 * 1024  # Only this much of a CSV is read to detect its layout
+CSV_SNIFF_LINES = 50
+CSV_ENCODINGS = ("utf-8", "cp1256", "latin-1")  # Tried in order; latin-1 never fails
+CSV_DELIMITERS = ",;\t|"
+CSV_BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+
+
+def _decode_sample(raw):
+    for bom, encoding in CSV_BOMS:
+        if raw.startswith(bom):
+            return encoding, codecs.getincrementaldecoder(encoding)().decode(raw, final=False)
+    for encoding in CSV_ENCODINGS:
+        try:
+            # Incremental decode tolerates a multi-byte character cut at the sample end
+            return encoding, codecs.getincrementaldecoder(encoding)().decode(raw, final=False)
+        except UnicodeDecodeError:
+            continue
+
+
+def sniff_csv(file_path):
+    """Detect a CSV's encoding, delimiter and header row from its first few KB.
+
+    Returns a dict with encoding, delimiter, header_row (lines to skip before
+    the header) and columns. Title or preamble lines above the table are
+    skipped by taking the first line whose field count matches the most common
+    field count in the sample.
+    """
+    with open(file_path, 'rb') as f:
+        raw = f.read(CSV_SNIFF_BYTES)
+    encoding, text = _decode_sample(raw)
+    lines = text.splitlines()
+    if len(raw) == CSV_SNIFF_BYTES and len(lines) > 1:
+        lines.pop()  # Last line is probably cut short
+    lines = lines[:CSV_SNIFF_LINES]
+
+    offset = 0
+    if lines and lines[0].lower().startswith("sep=") and len(lines[0]) == 5:
+        # Excel's explicit delimiter hint
+        delimiters, offset = lines[0][4], 1
+    else:
+        delimiters = CSV_DELIMITERS
+
+    best = None
+    for delimiter in delimiters:
+        rows = [next(csv.reader([line], delimiter=delimiter), []) for line in lines[offset:]]
+        counts = [len(row) for row, line in zip(rows, lines[offset:]) if line.strip()]
+        if not counts:
+            continue
+        modal = max(set(counts), key=counts.count)
+        score = (modal > 1, counts.count(modal), modal)
+        if best is None or score > best[0]:
+            best = (score, delimiter, rows, modal)
+
+    if best is None:
+        return {"encoding": encoding, "delimiter": delimiters[0], "header_row": offset, "columns": []}
+    _, delimiter, rows, modal = best
+    header_row = next(i for i, (row, line) in enumerate(zip(rows, lines[offset:]))
+                      if line.strip() and len(row) == modal)
+    return {
+        "encoding": encoding,
+        "delimiter": delimiter,
+        "header_row": offset + header_row,
+        "columns": rows[header_row],
+    }
+
+
+# pandas engines per workbook format, fastest first, with the module each needs.
+# calamine (Rust) reads every format and is several times faster than the
+# pure-Python readers; the format-specific engines are the fallback chain.
+EXCEL_ENGINES = {
+    ".xlsx": [("calamine", "python_calamine"), ("openpyxl", "openpyxl")],
+    ".xlsm": [("calamine", "python_calamine"), ("openpyxl", "openpyxl")],
+    ".xls": [("calamine", "python_calamine"), ("xlrd", "xlrd")],
+    ".xlsb": [("calamine", "python_calamine"), ("pyxlsb", "pyxlsb")],
+    ".ods": [("calamine", "python_calamine"), ("odf", "odf")],
+}
+_installed_modules = {}
+
+
+def available_engines(extension):
+    """Installed pandas engines for a workbook extension, fastest first."""
+    engines = []
+    for engine, module in EXCEL_ENGINES.get(extension, []):
+        if module not in _installed_modules:
+            _installed_modules[module] = importlib.util.find_spec(module) is not None
+        if _installed_modules[module]:
+            engines.append(engine)
+    return engines
+
+
+def read_excel_sheets(file_path, read_sheet):
+    """Apply read_sheet(excel, sheet_name) to every sheet of a workbook.
+
+    Tries the available engines fastest first and falls back to the next one
+    when an engine cannot read the file. Returns ([(sheet_name, result), ...],
+    (engine, open_seconds, read_seconds)).
+    """
+    extension = os.path.splitext(file_path)[1].lower()
+    engines = available_engines(extension)
+    if not engines:
+        needed = " or ".join(module for _, module in EXCEL_ENGINES[extension])
+        raise ValueError(f"No reader installed for {extension} files (install {needed})")
+    error = None
+    for engine in engines:
+        started = time.perf_counter()
+        try:
+            with pd.ExcelFile(file_path, engine=engine) as excel:
+                opened = time.perf_counter()
+                sheets = [(sheet_name, read_sheet(excel, sheet_name)) for sheet_name in excel.sheet_names]
+            return sheets, (engine, opened - started, time.perf_counter() - opened)
+        except Exception as e:
+            error = e
+    raise error
+
+
+def _read_header(excel, sheet_name):
+    # Read the Excel file without specifying the header
+    df = pd.read_excel(excel, sheet_name=sheet_name, header=None, nrows=10)
+    # Find the first non-null row
+    first_non_null_index = df.first_valid_index()
+
+    if first_non_null_index is not None:
+        # Set the first non-null row as the header
+        new_header = df.iloc[first_non_null_index]  # Get the first non-null row
+        df = df[1:]  # Take the data less the header row
+        df.columns = new_header  # Set the new header
+
+    # Now df has the first non-null row as the columns
+    return df.columns.tolist()
+
+
+def read_file_columns(file_path):
+    """Return ([(sheet_name, columns), ...], (reader, open_seconds, read_seconds))
+    for an Excel or CSV file."""
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension in EXCEL_ENGINES:
+        return read_excel_sheets(file_path, _read_header)
+    started = time.perf_counter()
+    sheets = []
+    if extension == '.csv':
+        sheets.append(('CSV', sniff_csv(file_path)["columns"]))
+    return sheets, ("csv-sniffer", 0.0, time.perf_counter() - started)
+
+
+REPORT_HEADER = ['File Name', 'Path', 'Sheet Name', 'Column Name']
+PROFILE_HEADER = REPORT_HEADER + ['Inferred Type', 'Null Fraction', 'Min', 'Max', 'Approx Distinct', 'Rows']
+PROFILE_CHUNK_ROWS = 50000  # Rows held in memory at once while profiling
+HLL_PRECISION = 12  # 4096 registers per column, ~1.6% standard error
+NUMERIC_KINDS = {"integer", "floating", "mixed-integer-float", "decimal"}
+
+
+class HyperLogLog:
+    """Approximate distinct counter with a fixed memory footprint."""
+
+    def __init__(self, precision=HLL_PRECISION):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = np.zeros(self.size, dtype=np.uint8)
+        self.alpha = 0.7213 / (1 + 1.079 / self.size)
+
+    def add_hashes(self, hashes):
+        """Add an array of uint64 hashes."""
+        if not len(hashes):
+            return
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.intp)
+        rest = hashes << np.uint64(self.precision)
+        # The top 32 remaining bits convert to float64 exactly, so log2 is safe
+        top = (rest >> np.uint64(32)).astype(np.float64)
+        rank = np.where(top > 0, 32 - np.floor(np.log2(np.maximum(top, 1))), 33).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def count(self):
+        estimate = self.alpha * self.size * self.size / np.sum(np.exp2(-self.registers.astype(np.float64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * self.size and zeros:
+            estimate = self.size * np.log(self.size / zeros)  # Linear counting for small sets
+        return int(round(estimate))
+
+
+class ColumnProfile:
+    """Streaming statistics for one column: type, nulls, min/max and distinct count."""
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = 0
+        self.nulls = 0
+        self.kinds = set()
+        self.min = None
+        self.max = None
+        self.distinct = HyperLogLog()
+
+    def update(self, series):
+        self.rows += len(series)
+        values = series.dropna()
+        self.nulls += len(series) - len(values)
+        if values.empty:
+            return
+        kind = pd.api.types.infer_dtype(values, skipna=True)
+        self.kinds.add(kind)
+        if kind in NUMERIC_KINDS:
+            values = pd.to_numeric(values, errors="coerce").dropna()
+            if values.empty:
+                return
+            self._merge_bounds(values.min(), values.max())
+            # Hash ints and floats alike so 1 and 1.0 count as one value across chunks
+            values = values.astype("float64")
+        else:
+            if kind not in ("datetime", "datetime64", "date", "boolean"):
+                values = values.astype(str)
+            self._merge_bounds(values.min(), values.max())
+        self.distinct.add_hashes(pd.util.hash_pandas_object(values, index=False).to_numpy())
+
+    def _merge_bounds(self, low, high):
+        low, high = _to_python(low), _to_python(high)
+        if self.min is None:
+            self.min, self.max = low, high
+            return
+        try:
+            self.min, self.max = min(self.min, low), max(self.max, high)
+        except TypeError:
+            # Column mixes types across chunks; fall back to text ordering
+            self.min = min(str(self.min), str(low))
+            self.max = max(str(self.max), str(high))
+
+    def inferred_type(self):
+        if not self.kinds:
+            return "empty"
+        if len(self.kinds) == 1:
+            return next(iter(self.kinds))
+        if self.kinds <= NUMERIC_KINDS:
+            return "floating"
+        return "mixed"
+
+    def cells(self):
+        null_fraction = self.nulls / self.rows if self.rows else 1.0
+        return [self.name, self.inferred_type(), round(null_fraction, 4),
+                self.min, self.max, self.distinct.count(), self.rows]
+
+
+def _to_python(value):
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def _profile_chunks(names, chunks):
+    """Fold DataFrame chunks (columns by position) into per-column profile cells."""
+    profiles = [ColumnProfile(name) for name in names]
+    for chunk in chunks:
+        for position, profile in enumerate(profiles):
+            profile.update(chunk.iloc[:, position])
+    return [profile.cells() for profile in profiles]
+
+
+def _header_names(values):
+    return [value if value is not None and not pd.isna(value) else f"Unnamed: {i}"
+            for i, value in enumerate(values)]
+
+
+def _iter_xlsx_chunks(rows, width):
+    batch = []
+    for row in rows:
+        row = list(row[:width]) + [None] * (width - len(row))
+        batch.append(row)
+        if len(batch) >= PROFILE_CHUNK_ROWS:
+            yield pd.DataFrame(batch)
+            batch = []
+    if batch:
+        yield pd.DataFrame(batch)
+
+
+def _profile_sheet(excel, sheet_name):
+    df = pd.read_excel(excel, sheet_name=sheet_name, header=None)
+    first_non_null_index = df.first_valid_index()
+    if first_non_null_index is None:
+        return []
+    names = _header_names(df.iloc[first_non_null_index].tolist())
+    body = df.iloc[first_non_null_index + 1:]
+    chunks = (body.iloc[i:i + PROFILE_CHUNK_ROWS] for i in range(0, len(body), PROFILE_CHUNK_ROWS))
+    return _profile_chunks(names, chunks)
+
+
+def profile_file(file_path):
+    """Return ([(sheet_name, [profile cells per column]), ...], (reader, open_seconds, read_seconds)).
+
+    xlsx/xlsm sheets are streamed with openpyxl read-only mode and CSVs in pandas
+    chunks, so memory stays bounded by PROFILE_CHUNK_ROWS. Other workbook
+    formats have no streaming reader and are loaded one sheet at a time through
+    the fastest available engine.
+    """
+    sheets = []
+    extension = os.path.splitext(file_path)[1].lower()
+    started = time.perf_counter()
+    if extension in ('.xlsx', '.xlsm'):
+        wb = load_workbook(file_path, read_only=True, data_only=True)
+        opened = time.perf_counter()
+        try:
+            for ws in wb.worksheets:
+                rows = ws.iter_rows(values_only=True)
+                header = next((row for row in rows if any(v is not None for v in row)), None)
+                if header is None:
+                    sheets.append((ws.title, []))
+                    continue
+                names = _header_names(header)
+                sheets.append((ws.title, _profile_chunks(names, _iter_xlsx_chunks(rows, len(names)))))
+        finally:
+            wb.close()
+        return sheets, ("openpyxl-stream", opened - started, time.perf_counter() - opened)
+    if extension in EXCEL_ENGINES:
+        return read_excel_sheets(file_path, _profile_sheet)
+    if extension == '.csv':
+        layout = sniff_csv(file_path)
+        opened = time.perf_counter()
+        if not layout["columns"]:
+            return [('CSV', [])], ("csv-sniffer", 0.0, opened - started)
+        with pd.read_csv(file_path, sep=layout["delimiter"], encoding=layout["encoding"],
+                         skiprows=layout["header_row"], engine="c",
+                         chunksize=PROFILE_CHUNK_ROWS) as reader:
+            first = next(reader, None)
+            if first is None:
+                sheets.append(('CSV', []))
+            else:
+                names = first.columns.tolist()
+                sheets.append(('CSV', _profile_chunks(names, itertools.chain([first], reader))))
+        return sheets, ("pandas-c", opened - started, time.perf_counter() - opened)
+    return sheets, ("none", 0.0, time.perf_counter() - started)
+
+
+def _parser_process_main(tasks, results, profile=False):
+    """Entry point of the isolated parser process."""
+    read = profile_file if profile else read_file_columns
+    while True:
+        file_path = tasks.get()
+        if file_path is None:
+            return
+        try:
+            sheets, reader = read(file_path)
+            results.put((file_path, "ok", sheets, reader))
+        except MemoryError:
+            results.put((file_path, "memory", "Out of memory while parsing", None))
+        except Exception as e:
+            results.put((file_path, "error", str(e), None))
+
+
+class IsolatedParser:
+    """Parses files in a child process with a hard time and memory budget.
+
+    A file that blows its budget gets the child killed and a fresh one started
+    for the next file, so one pathological workbook cannot stall the scan.
+    The memory budget needs psutil; without it only the time budget applies.
+    """
+    _warned_no_psutil = False
+
+    def __init__(self, timeout=FILE_TIMEOUT_SECONDS, memory_limit_mb=FILE_MEMORY_LIMIT_MB, profile=False):
+        self.timeout = timeout
+        self.profile = profile
+        self.memory_limit = memory_limit_mb * 1024 * 1024 if memory_limit_mb else None
+        if self.memory_limit is not None and psutil is None and not IsolatedParser._warned_no_psutil:
+            IsolatedParser._warned_no_psutil = True
+            log.warning("psutil is not installed; the %d MB per-file memory limit is not enforced "
+                        "(pip install psutil)", memory_limit_mb)
+        # spawn everywhere: forking a process that runs Qt threads is unsafe
+        self._context = multiprocessing.get_context("spawn")
+        self._process = None
+
+    def _start(self):
+        self._tasks = self._context.Queue()
+        self._results = self._context.Queue()
+        self._process = self._context.Process(
+            target=_parser_process_main, args=(self._tasks, self._results, self.profile), daemon=True)
+        self._process.start()
+
+    def _kill(self):
+        if self._process is not None:
+            self._process.kill()
+            self._process.join()
+            self._process = None
+
+    def _memory_exceeded(self):
+        if psutil is None or self.memory_limit is None:
+            return False
+        try:
+            return psutil.Process(self._process.pid).memory_info().rss > self.memory_limit
+        except psutil.Error:
+            return False
+
+    def parse(self, file_path, should_stop=None):
+        """Return (status, payload, reader) where status is ok, error, timeout,
+        memory, crashed or stopped; payload is the sheet list or the failure
+        reason and reader the (engine, open_seconds, read_seconds) that
+        produced a sheet list."""
+        if self._process is None or not self._process.is_alive():
+            self._start()
+        self._tasks.put(file_path)
+        deadline = time.time() + self.timeout
+        while True:
+            try:
+                _, status, payload, reader = self._results.get(timeout=PARSER_POLL_SECONDS)
+                if status == "memory":
+                    self._kill()  # Heap may be fragmented; start clean
+                return status, payload, reader
+            except queue.Empty:
+                pass
+            if should_stop is not None and should_stop():
+                self._kill()
+                return "stopped", None, None
+            if not self._process.is_alive():
+                self._process = None
+                return "crashed", "Parser process exited unexpectedly", None
+            if self._memory_exceeded():
+                self._kill()
+                return "memory", f"Exceeded memory budget of {self.memory_limit // (1024 * 1024)} MB", None
+            if time.time() > deadline:
+                self._kill()
+                return "timeout", f"Timed out after {self.timeout} s", None
+
+    def close(self):
+        if self._process is not None and self._process.is_alive():
+            self._tasks.put(None)
+            self._process.join(PARSER_POLL_SECONDS * 4)
+        self._kill()
+
+
+PROGRESS_INTERVAL_SECONDS = 0.25  # At most 4 progress/error updates per second reach the GUI
+THROUGHPUT_WINDOW_SECONDS = 30  # Moving window used for throughput and ETA
+
+
+class ProgressAggregator:
+    """Coalesces per-file progress and errors into rate-limited updates.
+
+    Throughput is measured over a moving window instead of the whole run, and
+    the ETA is the slower of the bytes/sec and files/sec estimates, so neither a
+    tail of huge workbooks nor a tail of many tiny CSVs is underestimated.
+    """
+
+    def __init__(self, total_files, total_size, processed_files=0, processed_size=0,
+                 interval=PROGRESS_INTERVAL_SECONDS, window=THROUGHPUT_WINDOW_SECONDS):
+        self.total_files = total_files
+        self.total_size = total_size
+        self.processed_files = processed_files
+        self.processed_size = processed_size
+        self.interval = interval
+        self.window = window
+        self.start_time = time.time()
+        self._last_emit = 0.0
+        self.total_records = 0
+        self._samples = deque([(self.start_time, processed_files, processed_size)])
+        self._errors = []
+
+    def add_file(self, file_size):
+        now = time.time()
+        self.processed_files += 1
+        self.processed_size += file_size
+        self._samples.append((now, self.processed_files, self.processed_size))
+        # Keep one sample older than the window as the rate baseline
+        while len(self._samples) > 2 and self._samples[1][0] < now - self.window:
+            self._samples.popleft()
+
+    def add_error(self, message):
+        self._errors.append(message)
+
+    def take_errors(self):
+        errors, self._errors = self._errors, []
+        return errors
+
+    def due(self):
+        return time.time() - self._last_emit >= self.interval
+
+    def mark_emitted(self):
+        self._last_emit = time.time()
+
+    def elapsed(self):
+        return time.time() - self.start_time
+
+    def rates(self):
+        """Return (files_per_sec, bytes_per_sec) over the moving window."""
+        first_time, first_files, first_size = self._samples[0]
+        last_time, last_files, last_size = self._samples[-1]
+        span = last_time - first_time
+        if span <= 0:
+            return 0.0, 0.0
+        return (last_files - first_files) / span, (last_size - first_size) / span
+
+    def remaining_time(self):
+        files_rate, bytes_rate = self.rates()
+        remaining_files = self.total_files - self.processed_files
+        remaining_size = self.total_size - self.processed_size
+        estimates = []
+        if files_rate > 0:
+            estimates.append(remaining_files / files_rate)
+        if bytes_rate > 0:
+            estimates.append(remaining_size / bytes_rate)
+        return max(estimates) if estimates else 0.0
+
+    def snapshot(self):
+        files_rate, bytes_rate = self.rates()
+        return ScanProgress(
+            self.processed_files, self.total_files, self.processed_size, self.total_size,
+            self.elapsed(), self.remaining_time(), self.total_records, files_rate, bytes_rate)
+
+
+ScanProgress = namedtuple("ScanProgress", [
+    "processed_files", "total_files", "processed_size", "total_size", "elapsed",
+    "remaining_time", "total_records", "files_per_second", "bytes_per_second",
+])
+
+
+class XlsxReportSink:
+    """Writes the report as one workbook with Columns, Skipped Files and Duplicates sheets."""
+
+    def __init__(self, output_path, header):
+        self.output_path = output_path
+        self.wb = Workbook(write_only=True)
+        self.columns = self.wb.create_sheet("Columns")
+        self.columns.append(header)
+        self.skipped = self.wb.create_sheet("Skipped Files")
+        self.skipped.append(SKIPPED_HEADER)
+        self.duplicates = self.wb.create_sheet("Duplicates")
+        self.duplicates.append(DUPLICATES_HEADER)
+
+    def add_columns(self, row):
+        self.columns.append(row)
+
+    def add_skipped(self, row):
+        self.skipped.append(row)
+
+    def add_duplicate(self, row):
+        self.duplicates.append(row)
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.output_path)), exist_ok=True)
+        self.wb.save(self.output_path)
+
+    def abort(self):
+        pass
+
+
+class CsvReportSink:
+    """Writes the report as three CSV files; has no Excel row limit and streams to disk.
+
+    report.csv gets the column rows, report.skipped.csv and report.duplicates.csv
+    the other two tables. Files are written under a temporary name and renamed
+    when the scan completes.
+    """
+
+    def __init__(self, output_path, header):
+        base, _ = os.path.splitext(output_path)
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        self._targets = [output_path, base + ".skipped.csv", base + ".duplicates.csv"]
+        self._files = [open(path + ".part", "w", newline="", encoding="utf-8-sig") for path in self._targets]
+        self._writers = [csv.writer(f) for f in self._files]
+        for writer, first_row in zip(self._writers, (header, SKIPPED_HEADER, DUPLICATES_HEADER)):
+            writer.writerow(first_row)
+
+    def add_columns(self, row):
+        self._writers[0].writerow(row)
+
+    def add_skipped(self, row):
+        self._writers[1].writerow(row)
+
+    def add_duplicate(self, row):
+        self._writers[2].writerow(row)
+
+    def save(self):
+        for f, path in zip(self._files, self._targets):
+            f.close()
+            os.replace(path + ".part", path)
+
+    def abort(self):
+        for f, path in zip(self._files, self._targets):
+            f.close()
+            os.remove(path + ".part")
+
+
+SKIPPED_HEADER = ['File Name', 'Path', 'Reason']
+DUPLICATES_HEADER = ['File Name', 'Path', 'Same Content As']
+REPORT_SINKS = {".xlsx": XlsxReportSink, ".csv": CsvReportSink}
+
+
+def open_report_sink(output_path, header):
+    extension = os.path.splitext(output_path)[1].lower()
+    if extension not in REPORT_SINKS:
+        raise ValueError(f"Unsupported report type {extension!r}; use one of {', '.join(REPORT_SINKS)}")
+    return REPORT_SINKS[extension](output_path, header)
+
+
+def load_manifest(manifest_path, profile):
+    """Return {path: entry} from an earlier run's manifest, or {} if unusable."""
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("profile", False) != profile:
+        return {}
+    return manifest.get("files", {})
+
+
+def save_manifest(manifest_path, profile, files):
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"profile": profile, "files": files}, f, default=str)
+    os.replace(tmp_path, manifest_path)
+
+
+def enumerate_files(roots, include=DEFAULT_INCLUDE, should_stop=None):
+    """Return [(path, size, mtime_ns), ...] for files under roots matching the include globs."""
+    patterns = [pattern.lower() for pattern in include]
+    file_list = []
+    for folder_path in roots:
+        for root, _, files in os.walk(folder_path):
+            for file in files:
+                if should_stop is not None and should_stop():
+                    return None
+                if any(fnmatch.fnmatch(file.lower(), pattern) for pattern in patterns):
+                    file_path = os.path.join(root, file)
+                    try:
+                        stat = os.stat(file_path)
+                    except OSError:
+                        continue  # Vanished or unreadable between listing and stat
+                    file_list.append((file_path, stat.st_size, stat.st_mtime_ns))
+    return file_list
+
+
+class Scanner:
+    """Scans folders for Excel/CSV files and writes their column metadata report.
+
+    Files are parsed by `workers` isolated parser processes. With a manifest,
+    files whose size and modification time are unchanged since the previous run
+    reuse their stored rows instead of being parsed again. Progress and batched
+    errors are reported through the optional on_progress(ScanProgress) and
+    on_errors(list) callbacks at most every PROGRESS_INTERVAL_SECONDS.
+    """
+
+    def __init__(self, roots, output_path, profile=False, include=DEFAULT_INCLUDE, workers=1,
+                 manifest_path=None, on_progress=None, on_errors=None):
+        # Absolute, so report rows, checkpoint, manifest and duplicate links all
+        # name a file the same way whatever the working directory of the run
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.output_path = output_path
+        self.profile = profile
+        self.include = tuple(include)
+        self.workers = max(1, workers)
+        self.manifest_path = manifest_path
+        self.on_progress = on_progress
+        self.on_errors = on_errors
+        self.total_records = 0
+        self.reader_timings = {}  # reader -> [files, open seconds, read seconds]
+        self.phase_seconds = {}  # enumerate/hash/open/parse/process/write timings of the last run
+        self._is_running = True
+
+    def stop(self):
+        self._is_running = False
+
+    def _should_stop(self):
+        return not self._is_running
+
+    def run(self, file_list=None):
+        """Run one scan; returns True if the report was written, False if stopped.
+
+        file_list ([(path, size, mtime_ns), ...]) skips enumeration and
+        checkpoint resume; the daemon passes its own up-to-date file index.
+        """
+        self._is_running = True
+        self.total_records = 0
+        self.reader_timings = {}
+        self.phase_seconds = dict.fromkeys(("enumerate", "hash", "open", "parse", "process", "write"), 0.0)
+        checkpoint = ScanCheckpoint(self.roots, self.output_path, self.profile, self.include)
+
+        # Phase 1: File enumeration (skipped when resuming from a checkpoint)
+        if file_list is None and checkpoint.load():
+            file_list = checkpoint.file_list
+        else:
+            if file_list is None:
+                started = time.perf_counter()
+                file_list = enumerate_files(self.roots, self.include, self._should_stop)
+                self.phase_seconds["enumerate"] = time.perf_counter() - started
+                if file_list is None:
+                    return False
+            checkpoint.start(file_list)
+
+        previous = load_manifest(self.manifest_path, self.profile) if self.manifest_path else {}
+        stats = {path: (size, mtime) for path, size, mtime in file_list}
+        unchanged = {path for path, (size, mtime) in stats.items()
+                     if path in previous and not previous[path].get("transient")
+                     and previous[path]["size"] == size and previous[path]["mtime"] == mtime}
+        self._manifest = {}
+
+        # Phase 2: File processing
+        self._sink = open_report_sink(self.output_path, PROFILE_HEADER if self.profile else REPORT_HEADER)
+        self._checkpoint = checkpoint
+        # Only files sharing their size with another file can be copies, so
+        # only those are hashed; digest -> path of the copy that was parsed
+        size_counts = Counter(size for _, size, _ in file_list)
+        self._parsed_contents = {}
+
+        # Replay the rows of files completed before the interruption
+        for entry in checkpoint.replay():
+            self._write(entry, stats.get(entry["path"], (0, 0)))
+        resumed = [size for path, size, _ in file_list if path in checkpoint.completed]
+        self._tracker = ProgressAggregator(len(file_list), sum(size for _, size, _ in file_list),
+                                           len(resumed), sum(resumed))
+        self._tracker.total_records = self.total_records
+        self._publish()
+
+        timeout = PROFILE_TIMEOUT_SECONDS if self.profile else FILE_TIMEOUT_SECONDS
+        parsers = queue.Queue()
+        for _ in range(self.workers):
+            parsers.put(IsolatedParser(timeout=timeout, profile=self.profile))
+
+        def parse(file_path):
+            parser = parsers.get()
+            try:
+                return parser.parse(file_path, should_stop=self._should_stop)
+            finally:
+                parsers.put(parser)
+
+        started = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(self.workers) as pool:
+                try:
+                    self._dispatch(pool, parse, file_list, previous, unchanged, size_counts)
+                except BaseException:
+                    self._is_running = False  # Lets in-flight parses bail out before the pool joins
+                    raise
+        except BaseException:
+            checkpoint.flush()  # Whatever completed stays resumable
+            self._sink.abort()
+            raise
+        finally:
+            while not parsers.empty():
+                parsers.get().close()
+        self.phase_seconds["process"] = time.perf_counter() - started
+        self._publish()
+        for reader, (files, open_seconds, read_seconds) in sorted(self.reader_timings.items()):
+            log.info("Reader %s: %d files, open %.1f s, read %.1f s (%.3f s/file)", reader, files,
+                     open_seconds, read_seconds, (open_seconds + read_seconds) / files)
+
+        if not self._is_running:
+            # Keep the checkpoint so the next run on these roots/output resumes here
+            checkpoint.flush()
+            self._sink.abort()
+            return False
+
+        started = time.perf_counter()
+        self._sink.save()
+        if self.manifest_path:
+            save_manifest(self.manifest_path, self.profile, self._manifest)
+        self.phase_seconds["write"] = time.perf_counter() - started
+        checkpoint.discard()
+        return True
+
+    def _dispatch(self, pool, parse, file_list, previous, unchanged, size_counts):
+        """Reuse, dedupe or submit every pending file, keeping the pool at most twice full."""
+        in_flight = {}
+        for file_path, file_size, mtime in file_list:
+            if not self._is_running:
+                break
+            if file_path in self._checkpoint.completed:
+                continue
+            entry = previous.get(file_path)
+            if (file_path in unchanged
+                    and (entry.get("duplicate_of") is None or entry["duplicate_of"] in unchanged)):
+                self._complete(dict(entry, path=file_path), (file_size, mtime))
+                continue
+
+            digest = None
+            if size_counts[file_size] > 1:
+                started = time.perf_counter()
+                try:
+                    digest = file_digest(file_path)
+                except OSError:
+                    pass  # Unreadable; let the parser report it
+                self.phase_seconds["hash"] += time.perf_counter() - started
+            if digest in self._parsed_contents:
+                self._complete({"path": file_path, "rows": [], "reason": None, "digest": digest,
+                                "duplicate_of": self._parsed_contents[digest]}, (file_size, mtime))
+                continue
+            if digest:
+                # Claimed at submission so concurrent copies are not parsed twice
+                self._parsed_contents[digest] = file_path
+
+            future = pool.submit(parse, file_path)
+            in_flight[future] = (file_path, (file_size, mtime), digest)
+            if len(in_flight) >= self.workers * 2:
+                self._collect(in_flight, FIRST_COMPLETED)
+        self._collect(in_flight)
+
+    def _collect(self, in_flight, return_when=ALL_COMPLETED):
+        done, _ = wait(in_flight, return_when=return_when)
+        for future in done:
+            file_path, stat, digest = in_flight.pop(future)
+            status, payload, reader = future.result()
+            if status == "stopped":
+                continue
+            if reader is not None:
+                engine, open_seconds, read_seconds = reader
+                timing = self.reader_timings.setdefault(engine, [0, 0.0, 0.0])
+                timing[0] += 1
+                timing[1] += open_seconds
+                timing[2] += read_seconds
+                self.phase_seconds["open"] += open_seconds
+                self.phase_seconds["parse"] += read_seconds
+            rows = []
+            reason = None
+            if status == "ok":
+                for sheet_name, columns in payload:
+                    for col in columns:
+                        rows.append([
+                            os.path.basename(file_path),
+                            file_path,
+                            sheet_name,
+                            *(col if self.profile else [col])
+                        ])
+            else:
+                reason = payload
+                self._tracker.add_error(f"Error processing {file_path}: {reason}")
+            self._complete({"path": file_path, "rows": rows, "reason": reason, "digest": digest,
+                            "duplicate_of": None, "transient": status in TRANSIENT_STATUSES}, stat)
+
+    def _complete(self, entry, stat):
+        self._write(entry, stat)
+        self._checkpoint.record(entry["path"], entry["rows"], entry["reason"],
+                                digest=entry["digest"], duplicate_of=entry["duplicate_of"],
+                                transient=entry.get("transient", False))
+        self._tracker.total_records = self.total_records
+        self._tracker.add_file(stat[0])
+        if self._tracker.due():
+            self._publish()
+
+    def _write(self, entry, stat):
+        """Add one completed file to the report and the next manifest."""
+        file_path = entry["path"]
+        for row in entry["rows"]:
+            self._sink.add_columns(row)
+        if entry["reason"]:
+            self._sink.add_skipped([os.path.basename(file_path), file_path, entry["reason"]])
+        if entry["duplicate_of"]:
+            self._sink.add_duplicate([os.path.basename(file_path), file_path, entry["duplicate_of"]])
+        elif entry["digest"]:
+            self._parsed_contents[entry["digest"]] = file_path
+        self.total_records += len(entry["rows"])
+        self._manifest[file_path] = {
+            "size": stat[0], "mtime": stat[1], "rows": entry["rows"], "reason": entry["reason"],
+            "digest": entry["digest"], "duplicate_of": entry["duplicate_of"],
+            "transient": entry.get("transient", False),
+        }
+
+    def _publish(self):
+        if self.on_progress is not None:
+            self.on_progress(self._tracker.snapshot())
+        errors = self._tracker.take_errors()
+        if errors and self.on_errors is not None:
+            self.on_errors(errors)
+        self._tracker.mark_emitted()
@@ -0,0 +1,286 @@
+"""Throughput benchmark for the metadata scanner.
+
+Builds synthetic corpora once (many small CSVs, a few large workbooks,
+many-sheet workbooks, corrupt files, a deep folder tree, duplicated exports),
+scans each one headless and writes machine-readable results:
+
+    python scan_benchmark.py --workers 4 --json bench_before.json
+    ... change the scanner ...
+    python scan_benchmark.py --workers 4 --json bench_after.json --compare bench_before.json
+"""
+import os
+import sys
+import csv
+import json
+import time
+import queue
+import random
+import shutil
+import logging
+import argparse
+import platform
+import tempfile
+import multiprocessing
+from openpyxl import Workbook
+from metadata_scanner import Scanner, psutil
+
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+CORPUS_VERSION = 1
+CORPORA = ("small_csvs", "large_xlsx", "many_sheets", "corrupt", "deep_tree", "duplicates")
+POLL_SECONDS = 5  # How often a waiting benchmark checks that its scan process is still alive
+
+log = logging.getLogger("scan_benchmark")
+
+
+def write_csv(path, rows, columns, rnd):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow([f"col_{i}" for i in range(columns)])
+        for r in range(rows):
+            writer.writerow([r, rnd.random(), f"name {rnd.randint(0, 999)}"] + [rnd.randint(0, 10 ** 6)] * (columns - 3))
+
+
+def write_xlsx(path, sheets, rows, columns, rnd):
+    wb = Workbook(write_only=True)
+    for s in range(sheets):
+        ws = wb.create_sheet(f"Sheet{s + 1}")
+        ws.append([f"col_{i}" for i in range(columns)])
+        for r in range(rows):
+            ws.append([r, rnd.random(), f"name {rnd.randint(0, 999)}"] + [rnd.randint(0, 10 ** 6)] * (columns - 3))
+    wb.save(path)
+
+
+def build_small_csvs(folder, scale, rnd):
+    for i in range(int(2000 * scale)):
+        sub = os.path.join(folder, f"batch_{i // 200:03d}")
+        os.makedirs(sub, exist_ok=True)
+        write_csv(os.path.join(sub, f"export_{i:05d}.csv"), 20, 6, rnd)
+
+
+def build_large_xlsx(folder, scale, rnd):
+    for i in range(3):
+        write_xlsx(os.path.join(folder, f"large_{i}.xlsx"), 1, int(50000 * scale), 12, rnd)
+
+
+def build_many_sheets(folder, scale, rnd):
+    for i in range(max(1, int(20 * scale))):
+        write_xlsx(os.path.join(folder, f"book_{i:03d}.xlsx"), 50, 30, 8, rnd)
+
+
+def build_corrupt(folder, scale, rnd):
+    valid = os.path.join(folder, "valid.xlsx")
+    write_xlsx(valid, 1, 100, 5, rnd)
+    with open(valid, "rb") as f:
+        data = f.read()
+    for i in range(max(1, int(50 * scale))):
+        kind = i % 4
+        if kind == 0:  # Random bytes behind an Excel extension
+            name, payload = f"random_{i}.xlsx", rnd.randbytes(4096)
+        elif kind == 1:  # Zip cut in half
+            name, payload = f"truncated_{i}.xlsx", data[:len(data) // 2]
+        elif kind == 2:  # Legacy extension, not a BIFF file
+            name, payload = f"fake_{i}.xls", b"not a workbook\n" * 100
+        else:  # Binary garbage with a CSV extension
+            name, payload = f"binary_{i}.csv", bytes(rnd.randrange(256) for _ in range(2048))
+        with open(os.path.join(folder, name), "wb") as f:
+            f.write(payload)
+
+
+def build_deep_tree(folder, scale, rnd):
+    for branch in range(max(1, int(10 * scale))):
+        path = os.path.join(folder, f"branch_{branch}")
+        for depth in range(30):
+            path = os.path.join(path, f"level_{depth:02d}")
+            os.makedirs(path, exist_ok=True)
+            write_csv(os.path.join(path, "data.csv"), 10, 5, rnd)
+
+
+def build_duplicates(folder, scale, rnd):
+    original = os.path.join(folder, "original.xlsx")
+    write_xlsx(original, 3, 500, 10, rnd)
+    for i in range(max(1, int(200 * scale))):
+        shutil.copyfile(original, os.path.join(folder, f"copy_{i:04d}.xlsx"))
+
+
+BUILDERS = {
+    "small_csvs": build_small_csvs,
+    "large_xlsx": build_large_xlsx,
+    "many_sheets": build_many_sheets,
+    "corrupt": build_corrupt,
+    "deep_tree": build_deep_tree,
+    "duplicates": build_duplicates,
+}
+
+
+def ensure_corpus(corpus_dir, name, scale):
+    """Build the corpus unless a matching one is already on disk."""
+    folder = os.path.join(corpus_dir, name)
+    marker = os.path.join(folder, ".corpus.json")
+    spec = {"version": CORPUS_VERSION, "scale": scale}
+    try:
+        with open(marker, encoding="utf-8") as f:
+            if json.load(f) == spec:
+                return folder
+    except (OSError, ValueError):
+        pass
+    shutil.rmtree(folder, ignore_errors=True)
+    os.makedirs(folder)
+    log.info("Building corpus %s (scale %s)", name, scale)
+    BUILDERS[name](folder, scale, random.Random(name))  # Seeded: same corpus on every machine
+    with open(marker, "w", encoding="utf-8") as f:
+        json.dump(spec, f)
+    return folder
+
+
+def corpus_size(folder):
+    files = size = 0
+    for dirpath, _, filenames in os.walk(folder):
+        for filename in filenames:
+            if filename != ".corpus.json":
+                files += 1
+                size += os.path.getsize(os.path.join(dirpath, filename))
+    return files, size
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process and of its (finished) parser processes."""
+    if resource is not None:
+        # ru_maxrss is KB on Linux, bytes on macOS
+        unit = 1024 * 1024 if sys.platform == "darwin" else 1024
+        return {"scanner": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit,
+                "parsers": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / unit}
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return {"scanner": getattr(info, "peak_wset", info.rss) / (1024 * 1024), "parsers": None}
+    return {"scanner": None, "parsers": None}
+
+
+def count_rows(path):
+    try:
+        with open(path, encoding="utf-8-sig") as f:
+            return max(0, sum(1 for _ in f) - 1)
+    except OSError:
+        return 0
+
+
+def run_corpus(folder, workers, profile, results):
+    """Scan one corpus; runs in a fresh process so peak RSS belongs to this corpus alone."""
+    with tempfile.TemporaryDirectory() as out_dir:
+        output = os.path.join(out_dir, "report.csv")
+        scanner = Scanner([folder], output, profile=profile, workers=workers)
+        started = time.perf_counter()
+        scanner.run()
+        seconds = time.perf_counter() - started
+        results.put({
+            "seconds": seconds,
+            "records": count_rows(output),
+            "skipped": count_rows(os.path.join(out_dir, "report.skipped.csv")),
+            "duplicates": count_rows(os.path.join(out_dir, "report.duplicates.csv")),
+            "phases": scanner.phase_seconds,
+            "readers": {reader: {"files": files, "open": open_seconds, "read": read_seconds}
+                        for reader, (files, open_seconds, read_seconds) in scanner.reader_timings.items()},
+            "peak_rss_mb": peak_rss_mb(),
+        })
+
+
+def wait_for_result(process, results):
+    """The child's result, or None if it died (crash, OOM kill) before sending one."""
+    while True:
+        try:
+            return results.get(timeout=POLL_SECONDS)
+        except queue.Empty:
+            if not process.is_alive():
+                try:  # It may have sent the result just before exiting
+                    return results.get(timeout=1)
+                except queue.Empty:
+                    return None
+
+
+def benchmark(folder, name, workers, profile):
+    files, size = corpus_size(folder)
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    process = ctx.Process(target=run_corpus, args=(folder, workers, profile, results))
+    process.start()
+    result = wait_for_result(process, results)
+    process.join()
+    if result is None:
+        log.error("%s: scan process died with exit code %s", name, process.exitcode)
+        return dict(corpus=name, files=files, bytes=size, failed=True, exitcode=process.exitcode)
+    seconds = result["seconds"]
+    return dict(corpus=name, files=files, bytes=size,
+                files_per_second=files / seconds if seconds else None,
+                mb_per_second=size / (1024 * 1024) / seconds if seconds else None,
+                **result)
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {item["corpus"]: item for item in json.load(f)["results"]}
+    print(f"{'corpus':<14}{'before s':>10}{'after s':>10}{'speedup':>9}{'RSS MB':>9}")
+    for item in results:
+        before = baseline.get(item["corpus"])
+        if before is None or item.get("failed") or before.get("failed"):
+            continue
+        rss = item["peak_rss_mb"]["parsers"] or item["peak_rss_mb"]["scanner"] or 0
+        print(f"{item['corpus']:<14}{before['seconds']:>10.2f}{item['seconds']:>10.2f}"
+              f"{before['seconds'] / item['seconds']:>8.2f}x{rss:>9.0f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark scanner throughput on synthetic corpora.")
+    parser.add_argument("--corpus-dir", default=os.path.join(tempfile.gettempdir(), "scan_benchmark_corpus"),
+                        help="Where corpora are built and cached between runs")
+    parser.add_argument("--corpus", action="append", choices=CORPORA,
+                        help="Corpus to run, repeatable (default: all)")
+    parser.add_argument("--scale", type=float, default=1.0, help="Corpus size multiplier (default: 1.0)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Scanner workers")
+    parser.add_argument("--profile", action="store_true", help="Benchmark with column profiling enabled")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per corpus; the fastest is kept")
+    parser.add_argument("--json", help="Write results to this file instead of stdout")
+    parser.add_argument("--compare", help="Results JSON from an earlier run to compare against")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    results = []
+    for name in args.corpus or CORPORA:
+        folder = ensure_corpus(args.corpus_dir, name, args.scale)
+        runs = [benchmark(folder, name, args.workers, args.profile) for _ in range(max(1, args.repeat))]
+        completed = [run for run in runs if not run.get("failed")]
+        if not completed:
+            results.append(runs[-1])
+            continue
+        best = min(completed, key=lambda run: run["seconds"])
+        log.info("%s: %d files in %.2f s (%.1f files/s, %.1f MB/s)", name, best["files"],
+                 best["seconds"], best["files_per_second"], best["mb_per_second"])
+        results.append(best)
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "workers": args.workers,
+        "profile": args.profile,
+        "scale": args.scale,
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        compare(results, args.compare)
+    return 1 if any(item.get("failed") for item in results) else 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
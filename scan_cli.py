@@ -0,0 +1,180 @@
+"""Headless entry point for the Excel/CSV metadata scanner.
+
+One-off scan:
+    python scan_cli.py D:/shares/finance D:/shares/sales -o report.xlsx --workers 4
+
+Keep the report up to date, re-indexing only files that changed:
+    python scan_cli.py D:/shares/finance -o report.csv --manifest finance.manifest.json --watch
+"""
+import os
+import sys
+import time
+import fnmatch
+import logging
+import argparse
+import threading
+import multiprocessing
+from metadata_scanner import Scanner, DEFAULT_INCLUDE, enumerate_files
+
+try:
+    from watchdog.observers import Observer  # Optional: only needed for --watch
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+log = logging.getLogger("scan_cli")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Scan folders for Excel/CSV files and report their columns.")
+    parser.add_argument("roots", nargs="+", help="Folders to scan")
+    parser.add_argument("-o", "--output", required=True,
+                        help="Report path; .xlsx writes one workbook, .csv writes CSV files (no row limit)")
+    parser.add_argument("--include", action="append",
+                        help=f"File name glob to scan, repeatable (default: {' '.join(DEFAULT_INCLUDE)})")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Parser processes working in parallel (default: CPU count)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Profile columns (types, null ratio, min/max, distinct count)")
+    parser.add_argument("--manifest",
+                        help="Incremental manifest; unchanged files reuse their results from the previous run")
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and re-index files as they change (needs watchdog)")
+    parser.add_argument("--debounce", type=float, default=30,
+                        help="Seconds to collect file changes before re-indexing in --watch mode")
+    return parser.parse_args(argv)
+
+
+def log_progress(state):
+    log.info("%d/%d files, %.1f MB, %d records, %.1f files/s, ETA %s",
+             state.processed_files, state.total_files, state.processed_size / (1024 ** 2),
+             state.total_records, state.files_per_second,
+             time.strftime('%H:%M:%S', time.gmtime(state.remaining_time)))
+
+
+def log_errors(messages):
+    for message in messages:
+        log.warning(message)
+
+
+def generated_paths(scanner):
+    """The files a scan writes itself: report and sidecars, their .part files,
+    the checkpoint and the manifest, normalised for comparison."""
+    output = os.path.abspath(scanner.output_path)
+    base = os.path.splitext(output)[0]
+    paths = {output + ".checkpoint.jsonl"}
+    for target in (output, base + ".skipped.csv", base + ".duplicates.csv"):
+        paths.update((target, target + ".part"))
+    if scanner.manifest_path:
+        manifest = os.path.abspath(scanner.manifest_path)
+        paths.update((manifest, manifest + ".tmp"))
+    return {os.path.normcase(path) for path in paths}
+
+
+def is_generated(path, generated):
+    return os.path.normcase(os.path.abspath(path)) in generated
+
+
+class ChangeCollector(FileSystemEventHandler):
+    """Collects paths touched under the watched roots until the next re-index."""
+
+    def __init__(self, generated):
+        super().__init__()
+        self.generated = generated
+        self.lock = threading.Lock()
+        self.paths = set()
+
+    def on_any_event(self, event):
+        if event.event_type not in ("created", "modified", "deleted", "moved", "closed"):
+            return  # Opened / closed-without-writing
+        if event.is_directory and event.event_type == "modified":
+            return  # A file inside changed; that file has its own event
+        if is_generated(event.src_path, self.generated):
+            return  # Our own report, checkpoint or manifest
+        with self.lock:
+            self.paths.add(event.src_path)
+            if getattr(event, "dest_path", None):
+                self.paths.add(event.dest_path)
+
+    def take(self):
+        with self.lock:
+            paths, self.paths = self.paths, set()
+        return paths
+
+
+def apply_changes(index, paths, include, generated):
+    """Update the {path: (path, size, mtime_ns)} index for touched files and folders."""
+    patterns = [pattern.lower() for pattern in include]
+    for path in paths:
+        if is_generated(path, generated):
+            continue
+        if os.path.isdir(path):
+            # Folder created or moved in: pick up everything below it
+            for item in enumerate_files([path], include):
+                if not is_generated(item[0], generated):
+                    index[item[0]] = item
+        elif os.path.isfile(path):
+            if any(fnmatch.fnmatch(os.path.basename(path).lower(), pattern) for pattern in patterns):
+                stat = os.stat(path)
+                index[path] = (path, stat.st_size, stat.st_mtime_ns)
+        else:
+            # Deleted or moved away; may have been a folder
+            prefix = os.path.join(path, "")
+            for known in [known for known in index if known == path or known.startswith(prefix)]:
+                del index[known]
+
+
+def watch(scanner, roots, include, debounce):
+    if Observer is None:
+        raise SystemExit("--watch needs the watchdog package (pip install watchdog)")
+    # Files written by the scan itself must not trigger another scan
+    generated = generated_paths(scanner)
+    collector = ChangeCollector(generated)
+    observer = Observer()
+    for root in roots:
+        observer.schedule(collector, root, recursive=True)
+    observer.start()
+    try:
+        # Index once after the observer is running so no change falls in between
+        index = {item[0]: item for item in enumerate_files(roots, include)
+                 if not is_generated(item[0], generated)}
+        scanner.run(sorted(index.values()))
+        log.info("Initial scan written to %s; watching for changes", scanner.output_path)
+        while True:
+            time.sleep(debounce)
+            touched = collector.take()
+            if not touched:
+                continue
+            apply_changes(index, touched, include, generated)
+            log.info("%d paths changed; re-indexing", len(touched))
+            scanner.run(sorted(index.values()))
+    finally:
+        observer.stop()
+        observer.join()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    include = tuple(args.include or DEFAULT_INCLUDE)
+    # --watch re-runs the scan after every change; the manifest is what keeps those runs incremental
+    manifest = args.manifest or (args.output + ".manifest.json" if args.watch else None)
+    scanner = Scanner(args.roots, args.output, profile=args.profile, include=include,
+                      workers=args.workers, manifest_path=manifest,
+                      on_progress=log_progress, on_errors=log_errors)
+    try:
+        if args.watch:
+            watch(scanner, scanner.roots, include, args.debounce)
+        elif scanner.run():
+            log.info("Report written to %s", args.output)
+    except KeyboardInterrupt:
+        scanner.stop()
+        log.info("Interrupted; the next run with the same roots and output resumes from the checkpoint")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
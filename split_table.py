@@ -1,31 +1,40 @@
+"""Split stacked tables on Excel sheets into one sheet per table.
+
+    python split_table.py s50.xlsx --sheet main -o D:/PycharmProjects/data_SE
+    python split_table.py reports/*.xlsx -o split --workers 4
+"""
+import os
+import re
+import sys
+import argparse
+import itertools
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
 import pandas as pd
+from openpyxl import Workbook, load_workbook
+
 
-# Path to the input Excel file
-input_file = "s50.xlsx"
-sheet_name = "main"  # Name of the sheet containing the tables
-# Read the Excel file
-df = pd.read_excel(input_file, sheet_name=sheet_name, header=None)
+# Row ranges [start, stop) of the runs of non-blank rows
+def find_blocks(blank):
+    edges = np.diff(np.concatenate(([True], blank, [True])).astype(np.int8))
+    return np.flatnonzero(edges == -1), np.flatnonzero(edges == 1)
 
 
 # Function to split tables, clean them, and merge single-row tables
 def split_and_merge_tables(dataframe):
+    notnull = dataframe.notna().to_numpy()
+    blank = ~notnull.any(axis=1)  # Rows that are entirely blank
+    starts, stops = find_blocks(blank)
     tables = []
-    current_table = []
-    for _, row in dataframe.iterrows():
-        if row.isnull().all():  # Check if the row is entirely blank
-            if current_table:  # If there's data in the current table, save it
-                table_df = pd.DataFrame(current_table)
-                # Remove empty columns (columns with all NaN values)
-                table_df = table_df.dropna(axis=1, how='all')
-                tables.append(table_df)
-                current_table = []
-        else:
-            current_table.append(row.values)
-    # Append the last table if it exists
-    if current_table:
-        table_df = pd.DataFrame(current_table)
-        table_df = table_df.dropna(axis=1, how='all')  # Remove empty columns
-        tables.append(table_df)
+    if len(starts):
+        # Columns holding any value, per block (blank rows in between add nothing)
+        occupied = np.logical_or.reduceat(notnull, starts, axis=0)
+        for start, stop, keep in zip(starts, stops, occupied):
+            table = dataframe.iloc[start:stop]  # Row slice: no copy
+            if not keep.all():
+                table = table.iloc[:, np.flatnonzero(keep)]  # Remove empty columns
+            tables.append(table)
     # Merge single-row tables into the next table
     merged_tables = []
     i = 0
@@ -42,12 +51,281 @@ def split_and_merge_tables(dataframe):
     return merged_tables
 
 
-# Split the data into individual tables, clean them, and merge single-row tables
-tables = split_and_merge_tables(df)
-# Save each table into a separate sheet in a new Excel file
-output_file = "D:\PycharmProjects\data_SE\output_tables_split.xlsx"
-with pd.ExcelWriter(output_file, engine="openpyxl") as writer:
-    for i, table in enumerate(tables, start=1):
-        sheet_name = f"Table_{i}"  # Name each sheet as "Table_1", "Table_2", etc.
-        table.to_excel(writer, sheet_name=sheet_name, index=False, header=False)
-print(f"All tables have been saved to {output_file}")
+# Same tables as split_and_merge_tables, built from a row iterator one table at a time,
+# so only the table being read is in memory
+def stream_tables(rows):
+    block = []
+    pending = None  # Single-row table waiting to be merged into the next table
+    for row in itertools.chain(rows, [()]):  # Trailing blank row flushes the last table
+        if any(value is not None for value in row):
+            block.append(row)
+            continue
+        if not block:
+            continue
+        table = pd.DataFrame(block).dropna(axis=1, how='all')
+        block = []
+        if pending is not None:
+            yield pd.concat([pending, table], ignore_index=True)
+            pending = None
+        elif len(table) == 1:
+            pending = table
+        else:
+            yield table
+    if pending is not None:
+        yield pending
+
+
+SPLIT_THRESHOLD = 0.5  # Minimum confidence for a split that is not on a blank row
+
+
+# Per-cell mask of numbers (numeric strings and dates count as numbers too)
+def numeric_cells(dataframe):
+    numeric = np.empty(dataframe.shape, dtype=bool)
+    for i in range(dataframe.shape[1]):
+        column = dataframe.iloc[:, i]
+        if pd.api.types.is_numeric_dtype(column) and not pd.api.types.is_bool_dtype(column):
+            numeric[:, i] = column.notna().to_numpy()
+        else:
+            numeric[:, i] = pd.to_numeric(column, errors="coerce").notna().to_numpy()
+    return numeric
+
+
+def score_splits(notnull, numeric):
+    """Confidence (0..1) that each non-blank row starts a new table.
+
+    Returns (rows, scores, numeric_share) for the non-blank row positions. A row
+    after a blank row scores 1.0. Otherwise the score adds up two signals: a
+    header or title row right after a data row (a dtype shift), and a jump in
+    the span of occupied columns (offset or side-by-side blocks).
+    """
+    rows = np.flatnonzero(notnull.any(axis=1))
+    filled = notnull[rows]
+    count = filled.sum(axis=1)
+    numeric_share = numeric[rows].sum(axis=1) / np.maximum(count, 1)
+    scores = np.ones(len(rows))
+    if len(rows) < 2:
+        return rows, scores, numeric_share
+    first = filled.argmax(axis=1)
+    last = filled.shape[1] - 1 - filled[:, ::-1].argmax(axis=1)
+    data = numeric_share > 0  # Headers and titles are text only; data rows hold numbers
+    title = (count == 1) & ~data
+    header = (count >= 2) & ~data & np.append(data[1:], False)
+    overlap = np.minimum(last[1:], last[:-1]) - np.maximum(first[1:], first[:-1]) + 1
+    span = np.maximum(last[1:], last[:-1]) - np.minimum(first[1:], first[:-1]) + 1
+    shift = 1 - np.clip(overlap, 0, None) / span
+    opens = (header[1:] | title[1:]) & data[:-1]
+    scores[1:] = np.where(np.diff(rows) > 1, 1.0, np.clip(0.6 * opens + 0.5 * shift, 0, 1))
+    return rows, scores, numeric_share
+
+
+def detect_tables(dataframe, threshold=SPLIT_THRESHOLD):
+    """Split a sheet into tables on blank rows and on likely table starts.
+
+    Returns [(table, confidence), ...], confidence being the score of the split
+    that starts the table. A lone text row (a title) is kept with the table
+    after it; other single-row tables stay on their own.
+    """
+    notnull = dataframe.notna().to_numpy()
+    rows, scores, numeric_share = score_splits(notnull, numeric_cells(dataframe))
+    starts = np.flatnonzero(scores >= threshold)
+    if not len(starts):
+        return []
+    titles = np.flatnonzero((np.diff(starts) == 1) & (numeric_share[starts[:-1]] == 0))
+    starts = np.delete(starts, titles + 1)
+    stops = np.append(starts[1:], len(rows))
+    occupied = np.logical_or.reduceat(notnull[rows], starts, axis=0)
+    tables = []
+    for start, stop, keep in zip(starts, stops, occupied):
+        first, last = rows[start], rows[stop - 1] + 1
+        if last - first == stop - start:
+            table = dataframe.iloc[first:last]  # Contiguous rows: slice, no copy
+        else:
+            table = dataframe.iloc[rows[start:stop]]  # Title separated from its table by blank rows
+        if not keep.all():
+            table = table.iloc[:, np.flatnonzero(keep)]
+        tables.append((table, float(scores[start])))
+    return tables
+
+
+def is_title_row(row):
+    return pd.to_numeric(pd.Series(row, dtype=object), errors="coerce").isna().all()
+
+
+# detect_tables over a row iterator: each blank-separated block is split as soon as it ends
+def stream_detected_tables(rows, threshold=SPLIT_THRESHOLD):
+    block = []
+    titles = []  # Lone text rows waiting for the table after them
+    for row in itertools.chain(rows, [()]):  # Trailing blank row flushes the last block
+        if any(value is not None for value in row):
+            block.append(row)
+            continue
+        if not block:
+            continue
+        if len(block) == 1 and is_title_row(block[0]):
+            titles.append(block[0])
+        else:
+            found = detect_tables(pd.DataFrame(block), threshold)
+            if titles:
+                head = len(found[0][0])
+                found[0] = (pd.DataFrame(titles + block[:head]).dropna(axis=1, how='all'), 1.0)
+                titles = []
+            yield from found
+        block = []
+    if titles:
+        yield pd.DataFrame(titles).dropna(axis=1, how='all'), 1.0
+
+
+# Save each table into a separate sheet ("Table_1", "Table_2", ...) of a new Excel file.
+# Write-only workbook: rows are streamed to disk instead of being kept as cells.
+def write_tables(tables, output_file):
+    wb = Workbook(write_only=True)
+    count = 0
+    for count, table in enumerate(tables, start=1):
+        ws = wb.create_sheet(f"Table_{count}")
+        values = table.astype(object).where(table.notna(), None)
+        for row in values.itertuples(index=False, name=None):
+            ws.append(row)
+        ws.close()  # Finish the sheet's XML now instead of keeping every sheet's writer open
+    if not count:
+        wb.create_sheet("Table_1")  # A workbook needs at least one sheet
+    wb.save(output_file)
+    return count
+
+
+def list_sheets(input_file):
+    if input_file.lower().endswith((".xlsx", ".xlsm")):
+        wb = load_workbook(input_file, read_only=True)
+        try:
+            return wb.sheetnames
+        finally:
+            wb.close()
+    with pd.ExcelFile(input_file) as excel:
+        return excel.sheet_names
+
+
+def output_path(input_file, sheet_name, output_dir):
+    stem = os.path.splitext(os.path.basename(input_file))[0]
+    safe_sheet = re.sub(r'[\\/:*?"<>|]+', "_", sheet_name)
+    return os.path.join(output_dir, f"{stem}_{safe_sheet}_tables_split.xlsx")
+
+
+def unique_output_paths(jobs):
+    """Give jobs that would write the same output file (same file name in different
+    folders) distinct names: the input's folder name in front, then a counter."""
+    def key(path):
+        return os.path.normcase(os.path.abspath(path))
+
+    counts = Counter(key(output_file) for _, _, output_file in jobs)
+    used = set()
+    renamed = []
+    for input_file, sheet, output_file in jobs:
+        if counts[key(output_file)] > 1:
+            folder = os.path.basename(os.path.dirname(os.path.abspath(input_file)))
+            output_file = os.path.join(os.path.dirname(output_file), f"{folder}_{os.path.basename(output_file)}")
+        base, extension = os.path.splitext(output_file)
+        candidate = output_file
+        for n in itertools.count(2):
+            if key(candidate) not in used:
+                break
+            candidate = f"{base}_{n}{extension}"
+        used.add(key(candidate))
+        renamed.append((input_file, sheet, candidate))
+    return renamed
+
+
+# Split one sheet into its own output workbook; runs inside a pool worker.
+# xlsx/xlsm sheets are streamed, each table is written as soon as it ends.
+# Returns the confidence of each table's split. blank_only keeps the old blank-row rules.
+def split_sheet(input_file, sheet_name, output_file, threshold=SPLIT_THRESHOLD, blank_only=False):
+    confidences = []
+
+    def tables(found):
+        for table, confidence in found:
+            confidences.append(confidence)
+            yield table
+
+    if input_file.lower().endswith((".xlsx", ".xlsm")):
+        wb = load_workbook(input_file, read_only=True, data_only=True)
+        try:
+            ws = wb[sheet_name]
+            ws.reset_dimensions()  # Don't trust the stored sheet size; read every row there is
+            rows = ws.iter_rows(values_only=True)
+            if blank_only:
+                found = ((table, 1.0) for table in stream_tables(rows))
+            else:
+                found = stream_detected_tables(rows, threshold)
+            write_tables(tables(found), output_file)
+        finally:
+            wb.close()
+        return confidences
+    df = pd.read_excel(input_file, sheet_name=sheet_name, header=None)
+    if blank_only:
+        found = ((table, 1.0) for table in split_and_merge_tables(df))
+    else:
+        found = detect_tables(df, threshold)
+    write_tables(tables(found), output_file)
+    return confidences
+
+
+def split_workbooks(input_files, sheet_names=None, output_dir=".", workers=None,
+                    threshold=SPLIT_THRESHOLD, blank_only=False):
+    """Split every requested sheet of every input file, one sheet per worker process.
+
+    sheet_names=None splits all sheets. Returns a list of
+    (input_file, sheet_name, output_file, confidences, error) in completion order,
+    with one split confidence per table written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    results = []
+    jobs = []
+    seen = set()
+    for input_file in input_files:
+        if os.path.normcase(os.path.abspath(input_file)) in seen:
+            continue  # Listed twice
+        seen.add(os.path.normcase(os.path.abspath(input_file)))
+        try:
+            sheets = sheet_names or list_sheets(input_file)
+        except Exception as e:
+            results.append((input_file, None, None, [], str(e)))
+            continue
+        jobs.extend((input_file, sheet, output_path(input_file, sheet, output_dir)) for sheet in sheets)
+    # Two workers must never write the same file: a/s50.xlsx and b/s50.xlsx get different names
+    jobs = unique_output_paths(jobs)
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {pool.submit(split_sheet, *job, threshold, blank_only): job for job in jobs}
+        for future in as_completed(futures):
+            input_file, sheet, output_file = futures[future]
+            try:
+                results.append((input_file, sheet, output_file, future.result(), None))
+            except Exception as e:
+                results.append((input_file, sheet, None, [], str(e)))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Split stacked tables into one sheet per table.")
+    parser.add_argument("inputs", nargs="+", help="Excel files to split")
+    parser.add_argument("--sheet", action="append", help="Sheet to split, repeatable (default: all sheets)")
+    parser.add_argument("-o", "--output-dir", default=".", help="Folder for the split workbooks")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: CPU count)")
+    parser.add_argument("--threshold", type=float, default=SPLIT_THRESHOLD,
+                        help=f"Minimum confidence to split where there is no blank row (default: {SPLIT_THRESHOLD})")
+    parser.add_argument("--blank-only", action="store_true",
+                        help="Split on blank rows only and merge every single-row table into the next")
+    args = parser.parse_args(argv)
+    failed = 0
+    for input_file, sheet, output_file, confidences, error in split_workbooks(
+            args.inputs, args.sheet, args.output_dir, args.workers, args.threshold, args.blank_only):
+        source = f"{input_file} [{sheet}]" if sheet else input_file
+        if error:
+            failed += 1
+            print(f"Error splitting {source}: {error}")
+        else:
+            uncertain = sum(confidence < 0.8 for confidence in confidences)
+            note = f" ({uncertain} uncertain splits)" if uncertain else ""
+            print(f"{len(confidences)} tables from {source} saved to {output_file}{note}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
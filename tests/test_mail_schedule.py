@@ -0,0 +1,44 @@
+"""Schedule state across restarts and cron day-field semantics."""
+import json
+from datetime import datetime, timedelta
+from mail_schedule import CronExpression, Schedule
+
+
+def write_state(path, expression, last_run, next_due):
+    path.write_text(json.dumps({"expression": expression, "last_run": last_run.isoformat(),
+                                "next_due": next_due.isoformat() if next_due else None}), encoding="utf-8")
+
+
+def test_unchanged_schedule_keeps_a_missed_run_due(tmp_path):
+    state = tmp_path / "state.json"
+    last_run = datetime.now() - timedelta(days=3)
+    write_state(state, "0 8 * * *", last_run, last_run + timedelta(days=1))
+    schedule = Schedule("0 8 * * *", jitter=0, state_path=str(state))
+    assert schedule.due()
+
+    # Due time lost: catch up from the last run
+    write_state(state, "0 8 * * *", last_run, None)
+    assert Schedule("0 8 * * *", jitter=0, state_path=str(state)).due()
+
+
+def test_changed_schedule_starts_from_now(tmp_path):
+    state = tmp_path / "state.json"
+    last_run = datetime.now() - timedelta(days=3)
+    write_state(state, "0 8 * * *", last_run, last_run + timedelta(days=1))
+    before = datetime.now()
+    schedule = Schedule("30 9 * * *", jitter=0, state_path=str(state))
+    assert not schedule.due()
+    assert schedule.next_due == CronExpression("30 9 * * *").next_after(before)
+    assert schedule.last_run == last_run
+    assert json.loads(state.read_text(encoding="utf-8"))["expression"] == "30 9 * * *"
+
+
+def test_stepped_star_day_field_does_not_restrict():
+    # */2 day of month with Monday: cron takes odd days that are Mondays, not either
+    cron = CronExpression("0 8 */2 * 1")
+    assert cron.day_matches(datetime(2024, 1, 1))  # Monday the 1st
+    assert not cron.day_matches(datetime(2024, 1, 8))  # Monday the 8th
+    assert not cron.day_matches(datetime(2024, 1, 3))  # Wednesday the 3rd
+    # Both fields restricted without *: either one matches
+    cron = CronExpression("0 8 1-7 * 1")
+    assert cron.day_matches(datetime(2024, 1, 3)) and cron.day_matches(datetime(2024, 1, 15))
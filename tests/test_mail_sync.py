@@ -0,0 +1,123 @@
+"""queue_new_messages against a fake EWS folder: sync state and start_date paths."""
+from datetime import datetime
+from types import SimpleNamespace
+import pytest
+from exchangelib import UTC, EWSDateTime
+from exchangelib.errors import ErrorInvalidSyncStateData
+from mail_sync import JobQueue, queue_new_messages
+
+START = datetime(2024, 1, 4)
+KEY = "me@example.com/inbox"
+
+
+def message(n, day, attachments=True):
+    return SimpleNamespace(id=f"m{n}", changekey="ck", subject=f"s{n}", has_attachments=attachments,
+                           datetime_received=EWSDateTime(2024, 1, day, tzinfo=UTC))
+
+
+class FakeFolder:
+    """Change log of one folder; the sync state is the number of changes seen.
+    filter/only/order_by/iteration stand in for the start_date query."""
+
+    def __init__(self):
+        self.changes = []
+        self.item_sync_state = None
+        self.transferred = 0
+        self.filters = []
+        self.sync_fields = []
+
+    def create(self, item):
+        self.changes.append(("create", item))
+
+    def sync_items(self, only_fields=None, max_changes_returned=None):
+        self.sync_fields.append(only_fields)
+        state = self.item_sync_state
+        if state == "expired":
+            raise ErrorInvalidSyncStateData("Invalid sync state")
+        for change in self.changes[int(state or 0):]:
+            self.transferred += 1
+            yield change
+        self.item_sync_state = str(len(self.changes))
+
+    def filter(self, **filters):
+        self.filters.append(filters)
+        return self
+
+    def only(self, *fields):
+        return self
+
+    def order_by(self, *fields):
+        return self
+
+    def __iter__(self):
+        since = self.filters[-1]["datetime_received__gt"]
+        return iter([item for change, item in self.changes
+                     if change == "create" and item.has_attachments and item.datetime_received > since])
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = JobQueue(str(tmp_path / "queue.sqlite3"))
+    yield queue
+    queue.close()
+
+
+@pytest.fixture
+def folder():
+    folder = FakeFolder()
+    for n in range(10):
+        folder.create(message(n, 1 + n, attachments=n % 3 != 0))
+    folder.changes.append(("update", message(1, 2)))
+    folder.changes.append(("delete", message(2, 3)))
+    return folder
+
+
+def queued(queue):
+    return [row[0] for row in queue.db.execute("SELECT message_id FROM jobs ORDER BY rowid")]
+
+
+def test_first_sync_lists_from_start_date(queue, folder):
+    assert queue_new_messages(queue, folder, KEY, START) == 4
+    assert queued(queue) == ["m4", "m5", "m7", "m8"]
+    # The state is seeded with item IDs only; the messages come from the filtered listing
+    assert folder.sync_fields == [()]
+    assert folder.filters[-1]["datetime_received__gt"] == EWSDateTime(2024, 1, 4, tzinfo=UTC)
+    assert queue.sync_state(KEY) == "12"
+
+
+def test_next_sync_transfers_only_new_changes(queue, folder):
+    queue_new_messages(queue, folder, KEY, START)
+    folder.transferred = 0
+    assert queue_new_messages(queue, folder, KEY, START) == 0
+    assert folder.transferred == 0
+    # A late delivery with an old timestamp is still new to the sync
+    folder.create(message(10, 1))
+    folder.create(message(11, 20, attachments=False))
+    assert queue_new_messages(queue, folder, KEY, START) == 1
+    assert folder.transferred == 2
+    assert queued(queue)[-1] == "m10"
+
+
+def test_invalid_sync_state_starts_over_from_start_date(queue, folder):
+    queue.save_sync_state(KEY, "expired")
+    assert queue_new_messages(queue, folder, KEY, START) == 4
+    assert folder.filters
+    assert queue.sync_state(KEY) == "12"
+
+
+def test_interrupted_sync_keeps_the_old_state(queue, folder):
+    def lost(**kwargs):
+        yield "create", message(20, 5)
+        raise ConnectionError("connection lost")
+
+    folder.sync_items = lost
+    with pytest.raises(ConnectionError):
+        queue_new_messages(queue, folder, KEY, START)
+    assert queue.sync_state(KEY) is None
+
+
+def test_without_sync_state_uses_start_date_filter(queue, folder):
+    assert queue_new_messages(queue, folder, KEY, START, use_sync_state=False) == 4
+    assert folder.filters[-1]["has_attachments"] is True
+    assert folder.filters[-1]["datetime_received__gt"] == EWSDateTime(2024, 1, 4, tzinfo=UTC)
+    assert queue.sync_state(KEY) is None
@@ -0,0 +1,146 @@
+"""Uploader against a local stand-in for the /myflask/upload endpoint."""
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+from mail_sync import JobQueue, Pipeline
+from mail_upload import Uploader, retry_delay
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """Answers 200, except 503 with the server's Retry-After for the first
+    server.busy posts of a "flaky" file and always 503 for a "down" file.
+    Records every post on the server."""
+    protocol_version = "HTTP/1.1"  # Keep-alive, so connection reuse is visible
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        name = body.split(b'filename="')[1].split(b'"')[0].decode()
+        server = self.server
+        with server.lock:
+            server.posts.append((name, self.client_address[1], time.monotonic()))
+            attempt = sum(posted == name for posted, _, _ in server.posts)
+        if name.startswith("down") or (name.startswith("flaky") and attempt <= server.busy):
+            self.send_response(503)
+            self.send_header("Retry-After", server.retry_after)
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    server.lock = threading.Lock()
+    server.posts = []
+    server.busy = 2
+    server.retry_after = "0.2"
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/myflask/upload"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_files(folder, names):
+    paths = []
+    for name in names:
+        path = folder / name
+        path.write_bytes(name.encode() * 100)
+        paths.append(str(path))
+    return paths
+
+
+def test_connection_is_reused(server, tmp_path):
+    uploader = Uploader(server.url, workers=1, rate=0)
+    try:
+        results = uploader.run(make_files(tmp_path, [f"r{i}.csv" for i in range(10)]))
+    finally:
+        uploader.close()
+    assert set(results.values()) == {None}
+    assert len(server.posts) == 10
+    assert len({port for _, port, _ in server.posts}) == 1
+
+
+def test_503_is_retried_after_retry_after(server, tmp_path):
+    uploader = Uploader(server.url, workers=1, rate=0, retries=3, backoff=0.01)
+    try:
+        results = uploader.run(make_files(tmp_path, ["flaky.csv"]))
+    finally:
+        uploader.close()
+    assert results == {str(tmp_path / "flaky.csv"): None}
+    times = [posted_at for name, _, posted_at in server.posts if name == "flaky.csv"]
+    assert len(times) == server.busy + 1
+    assert all(later - earlier >= 0.19 for earlier, later in zip(times, times[1:]))
+
+
+def test_backoff_without_retry_after_doubles():
+    delays = [retry_delay(attempt, backoff=1.0) for attempt in range(4)]
+    for attempt, delay in enumerate(delays):
+        assert 0.5 * 2 ** attempt <= delay <= 2 ** attempt
+
+
+def test_final_failure_marks_job_failed(server, tmp_path):
+    queue_path = str(tmp_path / "queue.sqlite3")
+    (path,) = make_files(tmp_path, ["down.csv"])
+    queue = JobQueue(queue_path)
+    try:
+        queue.db.execute("INSERT INTO jobs (message_id, changekey, state) VALUES ('m1', 'ck', 'downloaded')")
+        queue.db.commit()
+        queue.add_file(path, "m1")
+        reported = []
+        server.retry_after = "0"
+        uploader = Uploader(server.url, workers=1, rate=0, retries=1, backoff=0.01)
+        try:
+            # No downloads: the pipeline uploads the file left 'downloaded' by an earlier run
+            Pipeline(uploader, queue_path, on_uploaded=lambda *result: reported.append(result)).run()
+        finally:
+            uploader.close()
+        assert len(server.posts) == 2
+        # Left by an earlier run, so it stands for no attachment saved by this one
+        assert reported == [(path, reported[0][1], 0)]
+        assert reported[0][1].startswith("HTTP 503")
+        state, attempts, error = queue.db.execute(
+            "SELECT state, attempts, error FROM jobs WHERE message_id = 'm1'").fetchone()
+        assert (state, attempts) == ("failed", 1)
+        assert error.startswith("HTTP 503")
+        assert queue.db.execute("SELECT state FROM files").fetchone() == ("failed",)
+    finally:
+        queue.close()
+
+
+class Saver:
+    """Stands in for an AttachmentDownloader: Pipeline.add sets on_saved."""
+    on_saved = None
+
+    def stop(self):
+        pass
+
+
+def test_shared_file_counts_every_attachment_saved_to_it(server, tmp_path):
+    queue_path = str(tmp_path / "queue.sqlite3")
+    shared, single = make_files(tmp_path, ["flaky.csv", "single.csv"])
+    reported = []
+    uploader = Uploader(server.url, workers=2, rate=0, retries=3, backoff=0.01)
+    try:
+        pipeline = Pipeline(uploader, queue_path, on_uploaded=lambda *result: reported.append(result))
+        saver = pipeline.add(Saver())
+
+        def download():
+            # Three messages carried the same attachment; it is still going up when the copies arrive
+            for path in (shared, single, shared, shared):
+                saver.on_saved(path)
+
+        pipeline.run(download)
+    finally:
+        uploader.close()
+    assert sum(name == "flaky.csv" for name, _, _ in server.posts) == server.busy + 1
+    assert sum(saved for _, _, saved in reported) == 4
+    assert sum(saved for path, _, saved in reported if path == shared) == 3
+    assert all(error is None for _, error, _ in reported)
@@ -0,0 +1,265 @@
+"""Scanner runs over small generated CSV trees: checkpoint resume and manifest reuse."""
+import csv
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import metadata_scanner
+from metadata_scanner import (HyperLogLog, IsolatedParser, ProgressAggregator, ScanCheckpoint, Scanner,
+                              profile_file, sniff_csv)
+
+
+class StoppingScanner(Scanner):
+    """Stops itself once `stop_after` files have completed, like a user pressing Stop."""
+
+    def __init__(self, *args, stop_after=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stop_after = stop_after
+        self.completed_paths = []
+
+    def _complete(self, entry, stat):
+        super()._complete(entry, stat)
+        self.completed_paths.append(entry["path"])
+        if len(self.completed_paths) == self.stop_after:
+            self.stop()
+
+
+def read_rows(path):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return list(csv.reader(f))[1:]
+
+
+@pytest.fixture
+def tree(tmp_path):
+    data = tmp_path / "data"
+    (data / "sub").mkdir(parents=True)
+    for n in range(6):
+        (data / f"f{n}.csv").write_text(f"id,name{n}\n{n},x\n", encoding="utf-8")
+    (data / "sub" / "copy.csv").write_text("id,name0\n0,x\n", encoding="utf-8")
+    (tmp_path / "elsewhere").mkdir()
+    return tmp_path
+
+
+def test_checkpoint_survives_a_torn_last_line(tmp_path):
+    output = str(tmp_path / "out.csv")
+    files = [["/data/a.csv", 10, 1], ["/data/b.csv", 20, 2], ["/data/c.csv", 30, 3]]
+    checkpoint = ScanCheckpoint(["/data"], output)
+    checkpoint.start(files)
+    checkpoint.record("/data/a.csv", [["a.csv", "/data/a.csv", "CSV", "id"]])
+    checkpoint.record("/data/b.csv", [], reason="Timed out after 120 s", transient=True)
+    checkpoint.flush()
+    with open(checkpoint.path, "a", encoding="utf-8") as f:
+        f.write('{"path": "/data/c.csv", "ro')  # Crash mid-write
+
+    loaded = ScanCheckpoint(["/data"], output)
+    assert loaded.load()
+    assert loaded.file_list == [tuple(item) for item in files]
+    assert loaded.completed == {"/data/a.csv", "/data/b.csv"}
+    entries = list(loaded.replay())
+    assert [entry["path"] for entry in entries] == ["/data/a.csv", "/data/b.csv"]
+    assert entries[1]["transient"] and not entries[0]["transient"]
+    # Different options mean a different scan; its checkpoint is not resumed
+    assert not ScanCheckpoint(["/data"], output, profile=True).load()
+    assert not ScanCheckpoint(["/other"], output).load()
+
+
+def test_resume_from_another_directory_keeps_paths_absolute(tree, monkeypatch):
+    data = str(tree / "data")
+    output = str(tree / "out.csv")
+    manifest = str(tree / "out.manifest.json")
+
+    monkeypatch.chdir(tree)
+    first = StoppingScanner(["data"], output, manifest_path=manifest, stop_after=3)
+    assert first.run() is False
+    assert os.path.exists(output + ".checkpoint.jsonl")
+
+    monkeypatch.chdir(tree / "elsewhere")
+    resumed = StoppingScanner([os.path.join("..", "data")], output, manifest_path=manifest)
+    assert resumed.run() is True
+    # Only the files the first run did not finish are processed again
+    assert not set(first.completed_paths) & set(resumed.completed_paths)
+    assert len(first.completed_paths) + len(resumed.completed_paths) == 7
+
+    rows = read_rows(output)
+    assert len(rows) == 12  # Two columns in each of the six distinct files
+    assert all(os.path.isabs(path) and path.startswith(data) for _, path, _, _ in rows)
+    duplicates = read_rows(str(tree / "out.duplicates.csv"))
+    assert len(duplicates) == 1
+    _, path, same_as = duplicates[0]
+    assert {path, same_as} == {os.path.join(data, "f0.csv"), os.path.join(data, "sub", "copy.csv")}
+
+    # The manifest written after the resume is reused in full by the next run
+    monkeypatch.chdir(tree)
+    incremental = StoppingScanner(["data"], output, manifest_path=manifest)
+    assert incremental.run() is True
+    assert incremental.reader_timings == {}
+    assert sorted(read_rows(output)) == sorted(rows)
+
+
+def test_manifest_retries_transient_failures_only(tree, monkeypatch):
+    data = str(tree / "data")
+    output = str(tree / "out.csv")
+    manifest = str(tree / "out.manifest.json")
+    parse = IsolatedParser.parse
+    failures = {os.path.join(data, "f1.csv"): ("timeout", "Timed out after 120 s", None),
+                os.path.join(data, "f2.csv"): ("error", "Unsupported format", None)}
+    monkeypatch.setattr(IsolatedParser, "parse", lambda self, file_path, should_stop=None:
+                        failures.get(file_path) or parse(self, file_path, should_stop))
+    assert Scanner([data], output, manifest_path=manifest).run() is True
+    assert len(read_rows(str(tree / "out.skipped.csv"))) == 2
+
+    monkeypatch.setattr(IsolatedParser, "parse", parse)
+    scanner = Scanner([data], output, manifest_path=manifest)
+    assert scanner.run() is True
+    # The timed-out file is parsed again; the deterministic error is reused
+    assert scanner.reader_timings["csv-sniffer"][0] == 1
+    skipped = read_rows(str(tree / "out.skipped.csv"))
+    assert [row[1:] for row in skipped] == [[os.path.join(data, "f2.csv"), "Unsupported format"]]
+
+
+def test_identical_files_are_parsed_once(tmp_path):
+    data = tmp_path / "data"
+    data.mkdir()
+    for name in ("a.csv", "copy1.csv", "copy2.csv"):
+        (data / name).write_text("id,name\n1,x\n", encoding="utf-8")
+    (data / "same_size.csv").write_text("id,city\n1,x\n", encoding="utf-8")
+    output = str(tmp_path / "out.csv")
+    scanner = Scanner([str(data)], output)
+    assert scanner.run() is True
+    assert scanner.reader_timings["csv-sniffer"][0] == 2
+    assert sorted(row[3] for row in read_rows(output)) == ["city", "id", "id", "name"]
+    duplicates = read_rows(str(tmp_path / "out.duplicates.csv"))
+    assert len(duplicates) == 2
+    # Every copy points at the one copy that was parsed
+    parsed = {same_as for _, _, same_as in duplicates}
+    assert len(parsed) == 1
+    copies = {str(data / name) for name in ("a.csv", "copy1.csv", "copy2.csv")}
+    assert {path for _, path, _ in duplicates} | parsed == copies
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+def test_progress_is_rate_limited_and_uses_a_moving_window(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(metadata_scanner, "time", clock)
+    tracker = ProgressAggregator(total_files=1000, total_size=1000 * 1000, interval=0.25, window=10)
+    assert tracker.due()
+    tracker.mark_emitted()
+    tracker.add_file(1000)
+    tracker.add_error("Error processing a.csv: bad")
+    assert not tracker.due()
+    clock.now += 0.25
+    assert tracker.due()
+    assert tracker.take_errors() == ["Error processing a.csv: bad"]
+    assert tracker.take_errors() == []
+
+    # A slow start falls out of the window: 1 file in the first 20 s, then 10 files/s
+    clock.now += 20
+    for _ in range(200):
+        clock.now += 0.1
+        tracker.add_file(1000)
+    files_rate, bytes_rate = tracker.rates()
+    assert files_rate == pytest.approx(10, rel=0.05)
+    assert bytes_rate == pytest.approx(10000, rel=0.05)
+    assert tracker.remaining_time() == pytest.approx(799 / 10, rel=0.05)
+
+    # Big files left: the bytes/sec estimate is the slower one and wins
+    tracker.total_size += 500 * 1000
+    assert tracker.remaining_time() == pytest.approx(1299000 / 10000, rel=0.05)
+    snapshot = tracker.snapshot()
+    assert (snapshot.processed_files, snapshot.total_files) == (201, 1000)
+
+
+@pytest.mark.parametrize("distinct", [10, 1000, 200000])
+def test_hyperloglog_estimate_is_within_a_few_percent(distinct):
+    hll = HyperLogLog()
+    values = pd.Series(np.arange(distinct, dtype="float64"))
+    step = -(-distinct // 4)
+    for start in range(0, distinct, step):  # Every value twice, across chunks
+        chunk = values.iloc[start:start + step]
+        hashes = pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+        hll.add_hashes(hashes)
+        hll.add_hashes(hashes)
+    assert hll.count() == pytest.approx(distinct, rel=0.05)
+
+
+def write_profile_sample(path):
+    frame = pd.DataFrame({
+        "id": range(1, 101),
+        "price": [1.5 * n if n % 4 else None for n in range(1, 101)],
+        "city": ["Riyadh", "Jeddah", "Dammam", "Abha"] * 25,
+    })
+    if path.suffix == ".csv":
+        frame.to_csv(path, index=False)
+    else:
+        frame.to_excel(path, index=False)
+
+
+@pytest.mark.parametrize("name", ["sample.csv", "sample.xlsx"])
+def test_profile_merges_statistics_across_chunks(tmp_path, monkeypatch, name):
+    monkeypatch.setattr(metadata_scanner, "PROFILE_CHUNK_ROWS", 7)
+    path = tmp_path / name
+    write_profile_sample(path)
+    sheets, _ = profile_file(str(path))
+    assert len(sheets) == 1
+    columns = {cells[0]: cells[1:] for cells in sheets[0][1]}
+    # Distinct counts are estimates
+    assert columns["id"] == ["integer", 0.0, 1, 100, pytest.approx(100, rel=0.05), 100]
+    kind, nulls, low, high, distinct, rows = columns["price"]
+    assert kind == "floating" and nulls == 0.25 and (low, high, rows) == (1.5, 148.5, 100)
+    assert distinct == pytest.approx(75, rel=0.05)
+    assert columns["city"] == ["string", 0.0, "Abha", "Riyadh", 4, 100]
+
+
+@pytest.mark.parametrize("encoding, expected", [
+    ("utf-8", "utf-8"),
+    ("utf-8-sig", "utf-8-sig"),
+    ("utf-16", "utf-16"),
+    ("cp1256", "cp1256"),
+])
+def test_sniff_csv_detects_the_encoding(tmp_path, encoding, expected):
+    path = tmp_path / "cities.csv"
+    path.write_bytes("الرقم,المدينة\n1,الرياض\n2,جدة\n".encode(encoding))
+    layout = sniff_csv(str(path))
+    assert layout["encoding"] == expected
+    assert layout["columns"] == ["الرقم", "المدينة"]
+
+
+@pytest.mark.parametrize("delimiter", [",", ";", "\t", "|"])
+def test_sniff_csv_detects_the_delimiter(tmp_path, delimiter):
+    path = tmp_path / "data.csv"
+    path.write_text("\n".join(delimiter.join(row) for row in [
+        ["id", "name", "note"], ["1", "a", "x,y"], ["2", "b", "z"]]) + "\n", encoding="utf-8")
+    layout = sniff_csv(str(path))
+    assert layout["delimiter"] == delimiter
+    assert layout["header_row"] == 0
+    assert layout["columns"] == ["id", "name", "note"]
+
+
+def test_sniff_csv_skips_preamble_and_honours_sep_hint(tmp_path):
+    path = tmp_path / "report.csv"
+    path.write_text("Monthly report\nGenerated 2024-01-31\n\nid;name;amount\n1;a;2,5\n2;b;3\n",
+                    encoding="utf-8")
+    layout = sniff_csv(str(path))
+    assert (layout["delimiter"], layout["header_row"]) == (";", 3)
+    assert layout["columns"] == ["id", "name", "amount"]
+
+    path.write_text("sep=|\nid|name\n1|a,b\n", encoding="utf-8")
+    layout = sniff_csv(str(path))
+    assert (layout["delimiter"], layout["header_row"], layout["columns"]) == ("|", 1, ["id", "name"])
+
+
+def test_sniff_csv_reads_only_the_sample(tmp_path, monkeypatch):
+    monkeypatch.setattr(metadata_scanner, "CSV_SNIFF_BYTES", 64)
+    path = tmp_path / "big.csv"
+    # The sample ends inside a two-byte character; it must still decode as UTF-8
+    path.write_bytes(("المعرف,الاسم\n" + "1,نص\n" * 1000).encode("utf-8"))
+    layout = sniff_csv(str(path))
+    assert layout["encoding"] == "utf-8"
+    assert layout["columns"] == ["المعرف", "الاسم"]
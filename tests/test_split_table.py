@@ -0,0 +1,214 @@
+"""split_table on small generated sheets: blank-row splitting, streaming, detection and batch mode."""
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from openpyxl import Workbook, load_workbook
+import split_table
+from split_table import (detect_tables, split_and_merge_tables, split_sheet, split_workbooks,
+                         stream_detected_tables, stream_tables, unique_output_paths)
+
+nan = np.nan
+
+
+def reference_split(dataframe):
+    """The original row-by-row split_and_merge_tables."""
+    tables = []
+    current_table = []
+    for _, row in dataframe.iterrows():
+        if row.isnull().all():
+            if current_table:
+                tables.append(pd.DataFrame(current_table).dropna(axis=1, how='all'))
+                current_table = []
+        else:
+            current_table.append(row.values)
+    if current_table:
+        tables.append(pd.DataFrame(current_table).dropna(axis=1, how='all'))
+    merged_tables = []
+    i = 0
+    while i < len(tables):
+        if len(tables[i]) == 1 and i + 1 < len(tables):
+            merged_tables.append(pd.concat([tables[i], tables[i + 1]], ignore_index=True))
+            i += 2
+        else:
+            merged_tables.append(tables[i])
+            i += 1
+    return merged_tables
+
+
+SHEET = pd.DataFrame([
+    [nan, nan, nan, nan],
+    ["Sales", nan, nan, nan],         # Title: merged into the next table
+    [nan, nan, nan, nan],
+    ["id", "name", nan, "amount"],
+    [1, "a", nan, 10.5],
+    [2, "b", nan, 20],
+    [nan, nan, nan, nan],
+    [nan, nan, nan, nan],
+    [nan, "code", "qty", nan],        # Offset table, different empty columns
+    [nan, "x", 3, nan],
+    [nan, nan, nan, nan],
+    ["Footer", nan, nan, nan],        # Last single row: kept on its own
+])
+
+
+def cell_values(table):
+    # Streamed tables hold None for empty cells where the others hold NaN
+    table = table.reset_index(drop=True).astype(object)
+    return table.where(table.notna(), nan)
+
+
+def assert_same_tables(found, expected):
+    assert len(found) == len(expected)
+    for table, reference in zip(found, expected):
+        # Values and the kept columns match; the old loop renumbered rows and lost dtypes
+        assert list(table.columns) == list(reference.columns)
+        pd.testing.assert_frame_equal(cell_values(table), cell_values(reference), check_dtype=False)
+
+
+@pytest.mark.parametrize("sheet", [
+    SHEET,
+    SHEET.iloc[1:6],
+    pd.DataFrame([[nan, nan], [nan, nan]]),
+    pd.DataFrame([[1, 2]]),
+    pd.DataFrame(np.where(np.random.default_rng(7).random((300, 6)) < 0.6, nan, 1.0)),
+])
+def test_split_and_merge_tables_matches_the_row_loop(sheet):
+    assert_same_tables(split_and_merge_tables(sheet), reference_split(sheet))
+
+
+def write_workbook(path, sheets):
+    """sheets: {sheet name: list of rows}; None is an empty cell."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    wb = Workbook()
+    wb.remove(wb.active)
+    for name, rows in sheets.items():
+        ws = wb.create_sheet(name)
+        for row in rows:
+            ws.append(row)
+    wb.save(path)
+    return str(path)
+
+
+def sheet_names(path):
+    wb = load_workbook(path, read_only=True)
+    try:
+        return wb.sheetnames
+    finally:
+        wb.close()
+
+
+def test_unique_output_paths_separates_same_named_inputs():
+    out = os.path.join("out", "s50_main_tables_split.xlsx")
+    other = os.path.join("out", "t_main_tables_split.xlsx")
+    jobs = [(os.path.join("a", "s50.xlsx"), "main", out),
+            (os.path.join("b", "s50.xlsx"), "main", out),
+            (os.path.join("x", "a", "s50.xlsx"), "main", out),
+            (os.path.join("a", "t.xlsx"), "main", other)]
+    assert [output for _, _, output in unique_output_paths(jobs)] == [
+        os.path.join("out", "a_s50_main_tables_split.xlsx"),
+        os.path.join("out", "b_s50_main_tables_split.xlsx"),
+        os.path.join("out", "a_s50_main_tables_split_2.xlsx"),
+        other,
+    ]
+
+
+def test_split_workbooks_batch(tmp_path):
+    rows = [["id", "name"], [1, "a"], [None, None], ["code", "qty"], ["x", 3]]
+    first = write_workbook(tmp_path / "a" / "s50.xlsx", {"main": rows, "extra": rows[:2]})
+    second = write_workbook(tmp_path / "b" / "s50.xlsx", {"main": rows})
+    missing = str(tmp_path / "missing.xlsx")
+    output_dir = str(tmp_path / "out")
+
+    results = split_workbooks([first, second, first, missing], output_dir=output_dir, workers=2)
+    errors = [(input_file, error) for input_file, _, _, _, error in results if error]
+    assert len(errors) == 1 and errors[0][0] == missing
+    done = {(input_file, sheet): (output_file, confidences)
+            for input_file, sheet, output_file, confidences, error in results if not error}
+    assert set(done) == {(first, "main"), (first, "extra"), (second, "main")}
+    outputs = [output_file for output_file, _ in done.values()]
+    assert len(set(outputs)) == 3
+    assert sheet_names(done[first, "main"][0]) == ["Table_1", "Table_2"]
+    assert sheet_names(done[first, "extra"][0]) == ["Table_1"]
+    assert len(done[second, "main"][1]) == 2
+
+    # --sheet limits the batch to the named sheets
+    results = split_workbooks([first, second], ["extra"], output_dir=output_dir, workers=1)
+    assert [(input_file, error is None) for input_file, _, _, _, error in sorted(results)] == [
+        (first, True), (second, False)]
+
+
+def sheet_rows(dataframe):
+    """The rows of a DataFrame as openpyxl's values_only iterator yields them."""
+    return [tuple(None if pd.isna(value) else value for value in row)
+            for row in dataframe.itertuples(index=False, name=None)]
+
+
+@pytest.mark.parametrize("sheet", [SHEET, SHEET.iloc[1:6], pd.DataFrame([[1, 2]])])
+def test_stream_tables_matches_split_and_merge_tables(sheet):
+    rows = iter(sheet_rows(sheet))
+    assert_same_tables(list(stream_tables(rows)), split_and_merge_tables(sheet))
+
+
+def test_split_sheet_streams_xlsx_to_the_same_tables(tmp_path):
+    source = write_workbook(tmp_path / "s50.xlsx", {"main": sheet_rows(SHEET)})
+    output = str(tmp_path / "split.xlsx")
+    assert split_sheet(source, "main", output, blank_only=True) == [1.0, 1.0, 1.0]
+    expected = split_and_merge_tables(pd.read_excel(source, sheet_name="main", header=None))
+    assert len(sheet_names(output)) == len(expected)
+    for name, table in zip(sheet_names(output), expected):
+        written = pd.read_excel(output, sheet_name=name, header=None)
+        pd.testing.assert_frame_equal(pd.DataFrame(written.to_numpy(dtype=object)),
+                                      pd.DataFrame(table.to_numpy(dtype=object)))
+
+
+STACKED = pd.DataFrame([
+    ["Sales 2024", nan, nan, nan, nan],  # Title kept with its table
+    ["id", "name", "amount", nan, nan],
+    [1, "a", 10, nan, nan],
+    [2, "b", 20, nan, nan],
+    ["code", "qty", nan, nan, nan],      # Header right under data rows: a new table
+    ["x", 3, nan, nan, nan],
+    ["y", 4, nan, nan, nan],
+    [nan, nan, nan, "k", "v"],           # Block moved to other columns
+    [nan, nan, nan, 1, 2],
+    [nan, nan, nan, nan, nan],
+    ["Notes", nan, nan, nan, nan],       # Title separated by a blank row
+    [nan, nan, nan, nan, nan],
+    ["id", "v", nan, nan, nan],
+    [5, 6, nan, nan, nan],
+])
+
+
+def test_detect_tables_splits_without_blank_rows():
+    found = detect_tables(STACKED)
+    assert [list(table.index) for table, _ in found] == [[0, 1, 2, 3], [4, 5, 6], [7, 8], [10, 12, 13]]
+    assert [list(table.columns) for table, _ in found] == [[0, 1, 2], [0, 1], [3, 4], [0, 1]]
+    confidences = [confidence for _, confidence in found]
+    assert confidences[0] == confidences[2] == confidences[3] == 1.0
+    assert 0.5 <= confidences[1] < 0.8  # Reported as uncertain
+
+
+def test_threshold_controls_the_uncertain_splits():
+    # Raising the threshold keeps the header-only split in the table above it
+    assert [len(table) for table, _ in detect_tables(STACKED, threshold=0.9)] == [7, 2, 3]
+
+
+def test_stream_detected_tables_matches_detect_tables():
+    rows = iter(sheet_rows(STACKED))
+    streamed = list(stream_detected_tables(rows))
+    found = detect_tables(STACKED)
+    assert [confidence for _, confidence in streamed] == [confidence for _, confidence in found]
+    assert_same_tables([table for table, _ in streamed], [table for table, _ in found])
+
+
+def test_main_threshold_option(tmp_path, capsys):
+    source = write_workbook(tmp_path / "stacked.xlsx", {"main": sheet_rows(STACKED)})
+    output_dir = str(tmp_path / "out")
+    output = os.path.join(output_dir, "stacked_main_tables_split.xlsx")
+    assert split_table.main([source, "-o", output_dir, "--workers", "1"]) == 0
+    assert len(sheet_names(output)) == 4
+    assert "(1 uncertain splits)" in capsys.readouterr().out
+    assert split_table.main([source, "-o", output_dir, "--workers", "1", "--threshold", "0.9"]) == 0
+    assert len(sheet_names(output)) == 3
+    assert "uncertain" not in capsys.readouterr().out